@@ -0,0 +1,41 @@
+"""
+Benchmark of pfam_alphafold's CRC64, one sequence at a time
+and in batches, against crc64iso, on random sequences.
+
+Usage: python benchmarks/bench_crc64.py [N [MAXLEN [SEED]]]
+"""
+import random
+import sys
+import timeit
+
+from pfam_alphafold.dataprocess.crc64 import crc64, crc64_many
+
+
+def benchmark(n: int = 10000, maxlen: int = 2700, seed: int = 0):
+    try:
+        from crc64iso import crc64iso
+    except ImportError:
+        raise SystemExit("the benchmark requires crc64iso: "
+                         "pip install pfam-alphafold[bench]")
+
+    rng = random.Random(seed)
+    sequences = ["".join(rng.choices("ACDEFGHIKLMNPQRSTVWY",
+                                     k=rng.randint(1, maxlen)))
+                 for _ in range(n)]
+
+    expected = [crc64iso.crc64(seq) for seq in sequences]
+    if ([crc64(seq) for seq in sequences] != expected or
+            crc64_many(sequences) != expected):
+        raise AssertionError("checksums differ from crc64iso")
+
+    ref = timeit.timeit(lambda: [crc64iso.crc64(s) for s in sequences],
+                        number=1)
+    new = timeit.timeit(lambda: [crc64(s) for s in sequences], number=1)
+    many = timeit.timeit(lambda: crc64_many(sequences), number=1)
+    print(f"{n:,} sequences: crc64iso {ref:.3f}s, "
+          f"crc64 {new:.3f}s ({ref / new:.1f}x), "
+          f"crc64_many {many:.3f}s ({ref / many:.1f}x)")
+
+
+if __name__ == "__main__":
+    benchmark(*map(int, sys.argv[1:]))
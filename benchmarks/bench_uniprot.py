@@ -0,0 +1,137 @@
+"""
+Benchmark of the UniProtKB flat file parser against a reference
+line-by-line parser, on synthetic records.
+
+Usage: python benchmarks/bench_uniprot.py [N [SEED]]
+"""
+import random
+import sys
+import timeit
+
+from pfam_alphafold.dataprocess import models, records, uniprot
+from pfam_alphafold.dataprocess.uniprot import OX_REG
+
+
+def make_record(i: int, rng: random.Random) -> str:
+    """Return a synthetic, TrEMBL-like record."""
+    length = rng.randint(50, 1000)
+    sequence = "".join(rng.choices("ACDEFGHIKLMNPQRSTVWY", k=length))
+    lines = [
+        f"ID   A0A{i:07d}_9BACT        Unreviewed;       {length} AA.",
+        f"AC   A0A{i:07d};",
+        "DT   01-JAN-2020, integrated into UniProtKB/TrEMBL.",
+        "DT   01-JAN-2020, sequence version 1.",
+        "DT   01-JAN-2024, entry version 10.",
+        f"DE   SubName: Full=Protein {i} {{ECO:0000313|EMBL:ABC{i}.1}};",
+        "DE   Flags: Fragment;" if i % 2 else "DE   Flags: Precursor;",
+        f"GN   ORFNames=ORF{i} {{ECO:0000313|EMBL:ABC{i}.1}};",
+        f"OS   Escherichia coli strain {i}",
+        "OS   (strain K12).",
+        "OC   Bacteria; Pseudomonadota; Gammaproteobacteria; "
+        "Enterobacterales;",
+        "OC   Enterobacteriaceae; Escherichia.",
+        f"OX   NCBI_TaxID={i} {{ECO:0000313|EMBL:ABC{i}.1}};",
+        f"RN   [1] {{ECO:0000313|EMBL:ABC{i}.1}}",
+        "RP   NUCLEOTIDE SEQUENCE [LARGE SCALE GENOMIC DNA].",
+        "RL   Submitted (01-JAN-2020) to the EMBL/GenBank/DDBJ databases.",
+        "CC   " + "-" * 67,
+        "CC   Copyrighted by the UniProt Consortium, "
+        "see https://www.uniprot.org/terms",
+        "CC   Distributed under the Creative Commons Attribution "
+        "(CC BY 4.0) License",
+        "CC   " + "-" * 67,
+        f"DR   EMBL; ABC{i}; ABC{i}.1; -; Genomic_DNA.",
+        f"DR   AlphaFoldDB; A0A{i:07d}; -.",
+        f"DR   Proteomes; UP{i:09d}; Chromosome.",
+        "DR   GO; GO:0016020; C:membrane; IEA:InterPro.",
+        "DR   InterPro; IPR000001; Kringle.",
+        "DR   Pfam; PF00051; Kringle; 1.",
+        "PE   4: Predicted;",
+        "KW   Membrane {ECO:0000256|ARBA:ARBA00022475};",
+        f"KW   Reference proteome {{ECO:0000313|Proteomes:UP{i:09d}}}."
+        if i % 3 else "KW   Transmembrane.",
+        "FT   DOMAIN          10..100",
+        "FT                   /note=\"Kringle\"",
+        "FT                   /evidence=\"ECO:0000259|Pfam:PF00051\"",
+        f"SQ   SEQUENCE   {length} AA;  {length * 110} MW;  "
+        f"{i:016X} CRC64;",
+    ]
+    for j in range(0, length, 60):
+        lines.append("     " + " ".join(sequence[k:k + 10]
+                                         for k in range(j, j + 60, 10)))
+
+    lines.append("//")
+    return "\n".join(lines) + "\n"
+
+
+def benchmark(n: int = 20000, seed: int = 0):
+    rng = random.Random(seed)
+    chunk = "".join(make_record(i, rng) for i in range(n)).encode()
+
+    def parse_and_encode() -> list[bytes]:
+        return [records.UNIPROT.encode_raw(entry)
+                for entry in uniprot.parse_chunk(chunk)]
+
+    def parse_and_encode_lines() -> list[bytes]:
+        return [records.UNIPROT.encode(entry) for entry in parse_lines(chunk)]
+
+    data = parse_and_encode()
+    for i, record in enumerate(map(records.decode, data)):
+        expected = (f"A0A{i:07d}", i % 2 == 0, i,
+                    ["Bacteria", "Pseudomonadota", "Gammaproteobacteria",
+                     "Enterobacterales", "Enterobacteriaceae", "Escherichia"],
+                    f"Escherichia coli strain {i} (strain K12)",
+                    i % 3 != 0, f"{i:016X}")
+        if (record.accession, record.complete, record.taxon_id,
+                record.lineage, record.species, record.ref_proteome,
+                record.crc64) != expected:
+            raise AssertionError(f"unexpected record: {record}")
+
+    if parse_and_encode_lines() != data:
+        raise AssertionError("records differ from parse_lines()")
+
+    ref = timeit.timeit(parse_and_encode_lines, number=1)
+    new = timeit.timeit(parse_and_encode, number=1)
+    print(f"{n:,} entries ({len(chunk) / 1024 ** 2:.0f} MB): "
+          f"parse_lines {ref:.3f}s, parse_chunk {new:.3f}s ({ref / new:.1f}x)")
+
+
+def parse_lines(chunk: bytes):
+    """Reference line-by-line parser of complete records."""
+    for line in map(str.rstrip, chunk.decode("utf-8").splitlines()):
+        key = line[:2]
+        value = line[5:]
+
+        if key == "ID":
+            cols = value.split()
+            entry = models.Protein(identifier=cols[0],
+                                   length=int(cols[2]),
+                                   reviewed=cols[1] == "Reviewed;")
+        elif key == "AC" and not entry.accession:
+            entry.accession = value.split(";")[0]
+        elif key == "DE":
+            if value.startswith("Flags:") and "Fragment" in value:
+                entry.complete = False
+        elif key == "OS":
+            if entry.species:
+                entry.species += " " + value
+            else:
+                entry.species = value
+        elif key == "OC":
+            for node in value.rstrip(".").split(";"):
+                if node.strip():
+                    entry.lineage.append(node.strip())
+        elif key == "OX":
+            entry.taxon_id = int(OX_REG.match(value.encode()).group(1))
+        elif key == "KW":
+            if "Reference proteome" in value:
+                entry.ref_proteome = True
+        elif key == "SQ":
+            entry.crc64 = value.split()[5]
+        elif key == "//":
+            entry.clean()
+            yield entry
+
+
+if __name__ == "__main__":
+    benchmark(*map(int, sys.argv[1:]))
@@ -1,6 +1,7 @@
 import argparse
 
-from pfam_alphafold.dataprocess import alphafold, database, interpro, uniprot
+from pfam_alphafold.dataprocess import (alphafold, database, interpro, store,
+                                        uniprot)
 
 
 def prepare():
@@ -9,15 +10,96 @@ def prepare():
     )
     subparsers = parser.add_subparsers(required=True)
 
+    codec_parser = argparse.ArgumentParser(add_help=False)
+    codec_parser.add_argument("--codec", choices=sorted(store.CODECS),
+                              default="zlib",
+                              help="Compression of the output file, "
+                                   "default: zlib.")
+    codec_parser.add_argument("--fpr", metavar="RATE", type=float, default=0,
+                              help="Add a Bloom filter of keys with this "
+                                   "false-positive rate, e.g. 0.01 "
+                                   "(default: no filter).")
+
+    store_parser = argparse.ArgumentParser(add_help=False,
+                                           parents=[codec_parser])
+    store_parser.add_argument("--memory", metavar="SIZE", type=parse_size,
+                              default=0,
+                              help="Approximate memory used to buffer "
+                                   "items before sorting them on disk, "
+                                   "e.g. 2G (shared by workers).")
+
+    minimal_parser = argparse.ArgumentParser(add_help=False)
+    minimal_parser.add_argument("--minimal", action="store_true",
+                                help="Only store the fields "
+                                     "required by pfafbuild.")
+
+    resume_parser = argparse.ArgumentParser(add_help=False)
+    resume_parser.add_argument("--resume", action="store_true",
+                               help="Resume an interrupted run, "
+                                    "skipping input already processed.")
+
+    keys_parser = argparse.ArgumentParser(add_help=False)
+    keys_parser.add_argument("--keep-keys", metavar="FILE",
+                             help="Only store proteins in this key set "
+                                  "(see alphafold-keys).")
+
     subparser = subparsers.add_parser("alphafold",
+                                      parents=[store_parser],
                                       help="Index AlphaFold predictions.")
     subparser.add_argument("-p", dest="processes", type=int, default=1,
                            help="Number of workers, default: 1.")
+    subparser.add_argument("--lossy", action="store_true",
+                           help="Round pLDDT scores to integers "
+                                "to reduce the output size.")
+    subparser.add_argument("--verify", action="store_true",
+                           help="Check pLDDT scores of JSON files against "
+                                "B-factors of mmCIF atoms (slower).")
+    subparser.add_argument("--resume", action="store_true",
+                           help="Resume an interrupted run, "
+                                "skipping archives already processed.")
+    subparser.add_argument("--shards", type=int, default=1,
+                           help="Split the output into N shards "
+                                "and a manifest file, default: 1.")
+    subparser.add_argument("--previous", metavar="PATH",
+                           help="Output of a previous run: only re-process "
+                                "new or changed archives.")
+    subparser.add_argument("--checksum", action="store_true",
+                           help="Compare archives by SHA-256 checksum "
+                                "instead of modification time.")
+    subparser.add_argument("--report", metavar="FILE",
+                           help="Write time spent in each stage, "
+                                "per archive, to a JSON file.")
+    subparser.add_argument("--part", metavar="I/N", type=parse_part,
+                           help="Only process the I-th of N parts "
+                                "of the archives (I from 1 to N).")
     subparser.add_argument("indir", help="Input directory of TAR files.")
     subparser.add_argument("output", help="Output file.")
     subparser.set_defaults(func=parse_alphafold)
 
-    subparser = subparsers.add_parser("pfam", help="Index Pfam matches.")
+    subparser = subparsers.add_parser("alphafold-merge",
+                                      parents=[codec_parser],
+                                      help="Merge AlphaFold stores "
+                                           "of separate parts.")
+    subparser.add_argument("inputs", metavar="input", nargs="+",
+                           help="Input files.")
+    subparser.add_argument("output", help="Output file.")
+    subparser.set_defaults(func=merge_alphafold)
+
+    subparser = subparsers.add_parser("alphafold-keys",
+                                      help="Export the key set of proteins "
+                                           "with a usable prediction.")
+    subparser.add_argument("--fpr", type=float, default=0.01,
+                           help="False-positive rate, default: 0.01.")
+    subparser.add_argument("input", help="AlphaFold store.")
+    subparser.add_argument("output", help="Output file.")
+    subparser.set_defaults(func=export_alphafold_keys)
+
+    subparser = subparsers.add_parser("pfam",
+                                      parents=[store_parser, minimal_parser,
+                                               keys_parser, resume_parser],
+                                      help="Index Pfam matches.")
+    subparser.add_argument("-p", dest="processes", type=int, default=1,
+                           help="Number of processes, default: 1.")
     subparser.add_argument("dat", help="Pfam-A dat file.")
     subparser.add_argument("xml", help="InterPro matches XML file.")
     subparser.add_argument("output", help="Output file.")
@@ -30,7 +112,11 @@ def prepare():
     # subparser.set_defaults(func=parse_predictions)
 
     subparser = subparsers.add_parser("uniprot",
+                                      parents=[store_parser, minimal_parser,
+                                               keys_parser, resume_parser],
                                       help="Index UniProtKB entries.")
+    subparser.add_argument("-p", dest="processes", type=int, default=1,
+                           help="Number of processes, default: 1.")
     subparser.add_argument("sprot", help="UniProtKB/Swiss-Prot flat file.")
     subparser.add_argument("trembl", help="UniProtKB/TrEMBL flat file.")
     subparser.add_argument("output", help="Output file.")
@@ -40,20 +126,67 @@ def prepare():
     args.func(args)
 
 
+def parse_size(value: str) -> int:
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    value = value.strip().upper().rstrip("B")
+    try:
+        if value[-1:] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        else:
+            return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {value}")
+
+
+def parse_part(value: str) -> tuple[int, int]:
+    try:
+        i, n = map(int, value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid part: {value}")
+
+    if not 1 <= i <= n:
+        raise argparse.ArgumentTypeError(f"invalid part: {value}")
+
+    return i, n
+
+
 def parse_alphafold(args):
-    alphafold.extract(args.indir, args.output, processes=args.processes)
+    alphafold.extract(args.indir, args.output, processes=args.processes,
+                      lossy=args.lossy, codec=args.codec,
+                      shards=args.shards, memory=args.memory,
+                      verify=args.verify, resume=args.resume,
+                      previous=args.previous, checksum=args.checksum,
+                      report=args.report, part=args.part, fpr=args.fpr)
+
+
+def merge_alphafold(args):
+    alphafold.merge(args.inputs, args.output, codec=args.codec, fpr=args.fpr)
+
+
+def export_alphafold_keys(args):
+    alphafold.export_keys(args.input, args.output, fpr=args.fpr)
 
 
 def parse_pfam(args):
-    interpro.index_pfam(args.dat, args.xml, args.output)
+    interpro.index_pfam(args.dat, args.xml, args.output, codec=args.codec,
+                        minimal=args.minimal, memory=args.memory,
+                        processes=args.processes, keep_keys=args.keep_keys,
+                        resume=args.resume, fpr=args.fpr)
 
 
 def parse_predictions(args):
-    interpro.index_predictions(args.dat, args.xml, args.output)
+    interpro.index_predictions(args.dat, args.xml, args.output,
+                               codec=args.codec, minimal=args.minimal,
+                               memory=args.memory, processes=args.processes,
+                               keep_keys=args.keep_keys, resume=args.resume,
+                               fpr=args.fpr)
 
 
 def parse_uniprot(args):
-    uniprot.index(args.sprot, args.trembl, args.output)
+    uniprot.index(args.sprot, args.trembl, args.output, codec=args.codec,
+                  minimal=args.minimal, memory=args.memory,
+                  processes=args.processes, keep_keys=args.keep_keys,
+                  resume=args.resume, fpr=args.fpr)
 
 
 def build():
@@ -1,36 +1,142 @@
 import glob
 import gzip
+import hashlib
 import json
 import os
 import multiprocessing as mp
 import re
 import tarfile
-from tempfile import mkstemp
-
-from crc64iso import crc64iso
+import time
+from array import array
+from dataclasses import dataclass, field
+from typing import BinaryIO
 
 from . import io, store
-
-
-def extract(indir: str, output: str, processes: int = 1, version: int = 4):
+from .crc64 import crc64_many
+
+
+# pLDDT scores have two decimals and range from 0 to 100:
+# they are stored as scaled integers (uint16), or rounded (uint8) if lossy
+SCALES = {"H": 100, "B": 1}
+
+THREE_TO_ONE = {
+    "ALA": "A", "ARG": "R", "ASN": "N", "ASP": "D", "CYS": "C",
+    "GLN": "Q", "GLU": "E", "GLY": "G", "HIS": "H", "ILE": "I",
+    "LEU": "L", "LYS": "K", "MET": "M", "PHE": "F", "PRO": "P",
+    "SER": "S", "THR": "T", "TRP": "W", "TYR": "Y", "VAL": "V",
+    "SEC": "U", "PYL": "O",
+}
+
+# Stages timed by workers: reading archives, decompressing members,
+# parsing confidence JSON files, parsing mmCIF files (in fast mode,
+# this includes reading and decompressing their header), computing
+# checksums, and packing, buffering and spilling predictions
+STAGES = ["tar", "gzip", "json", "cif", "crc64", "store"]
+
+
+def extract(indir: str, output: str, processes: int = 1, version: int = 4,
+            lossy: bool = False, codec: str = "none", shards: int = 1,
+            memory: int = 0, verify: bool = False, resume: bool = False,
+            previous: str | None = None, checksum: bool = False,
+            report: str | None = None, part: tuple[int, int] | None = None,
+            fpr: float = 0):
     io.log("processing AlphaFold predictions")
+    start = time.perf_counter()
 
+    indir = os.path.abspath(indir)
     output = os.path.abspath(output)
+    if shards > 1:
+        sstore = store.ShardedStore(output, mode="w", codec=codec,
+                                    shards=shards)
+    else:
+        sstore = store.SimpleStore(output, mode="w", codec=codec)
+
+    path = os.path.join(indir, "**", f"proteome-tax_id-*_v{version}.tar")
+    files = glob.glob(path, recursive=True)
+    if part is not None:
+        if previous:
+            raise ValueError("incremental updates of a part "
+                             "are not supported")
+
+        i, n = part
+        files = partition(files, n)[i - 1]
+        io.log(f"part {i}/{n}: {len(files):,} archives")
+
+    fingerprints = {file: get_fingerprint(file) for file in files}
+
+    # Incremental mode: only process new or changed archives
+    unchanged = set()
+    stale = set()
+    if previous:
+        previous = os.path.abspath(previous)
+        if previous == output:
+            raise ValueError("previous and new stores must be different")
+        elif shards > 1:
+            raise ValueError("incremental updates of sharded stores "
+                             "are not supported")
+
+        if checksum:
+            # Only archives of the same size as before can be unchanged
+            candidates = []
+            for name, (fingerprint, _) in iter_archives(previous):
+                file = os.path.join(indir, name)
+                new = fingerprints.get(file)
+                if ("sha256" in fingerprint and new is not None and
+                        new["size"] == fingerprint["size"]):
+                    candidates.append(file)
+
+            io.log(f"computing checksums of {len(candidates):,} archives")
+            with mp.Pool(processes) as pool:
+                for file, digest in zip(candidates,
+                                        pool.imap(get_checksum, candidates)):
+                    fingerprints[file]["sha256"] = digest
+
+        for name, (fingerprint, accessions) in iter_archives(previous):
+            file = os.path.join(indir, name)
+            if same_fingerprints(fingerprint, fingerprints.get(file)):
+                unchanged.add(file)
+            else:
+                # Changed or removed archive
+                stale.update(accessions)
+
+        io.log(f"{len(unchanged):,} archives unchanged, "
+               f"{len(fingerprints) - len(unchanged):,} new or changed, "
+               f"{len(stale):,} predictions discarded")
+
+    # Sorted runs written so far, and the archives they contain
+    checkpoint = store.Checkpoint(f"{output}.progress.jsonl", {
+        "indir": indir,
+        "version": version,
+        "lossy": lossy,
+        "verify": verify,
+        "previous": previous,
+        "checksum": checksum,
+        # As read back from JSON
+        "part": list(part) if part is not None else None,
+    })
+    if checkpoint.start(resume):
+        sstore.runs.extend(checkpoint.runs)
+        io.log(f"resuming: {len(checkpoint.batches):,} archives "
+               f"already processed")
+
+    files = [file for file in fingerprints
+             if file not in unchanged and file not in checkpoint.batches]
+    # Largest archives first, so a large one does not end up last
+    files.sort(key=lambda f: fingerprints[f]["size"], reverse=True)
+
     inqueue = mp.Queue()
     outqueue = mp.Queue()
 
     workers = []
-    for _ in range(max(1, processes - 1)):
-        fd, path = mkstemp(prefix=os.path.basename(output),
-                           dir=os.path.dirname(output))
-        os.close(fd)
+    num_workers = max(1, processes - 1)
+    for _ in range(num_workers):
         p = mp.Process(target=worker,
-                       args=(inqueue, version, path, outqueue))
+                       args=(inqueue, version, lossy, verify, checksum,
+                             output, memory // num_workers, outqueue))
         p.start()
         workers.append(p)
 
-    path = os.path.join(indir, "**", f"proteome-tax_id-*_v{version}.tar")
-    for file in glob.iglob(path, recursive=True):
+    for file in files:
         inqueue.put(file)
 
     for _ in workers:
@@ -38,51 +144,313 @@ def extract(indir: str, output: str, processes: int = 1, version: int = 4):
 
     progress = 0
     milestone = step = 1e7
-    stores = []
+    timings = Timings()
+    archive_timings = []
     running = len(workers)
     while running > 0:
         obj = outqueue.get()
-        if isinstance(obj, int):
-            progress += obj
+        if isinstance(obj, Timings):
+            progress += obj.predictions
+            timings.update(obj)
+            archive_timings.append(obj)
 
             if progress >= milestone:
-                io.log(f"{progress:,} predictions processed")
+                elapsed = time.perf_counter() - start
+                io.log(f"{progress:,} predictions processed "
+                       f"({progress / elapsed:,.0f}/s; {timings})")
                 milestone += step
-        else:
-            stores.append(obj)
+        elif obj is None:
             running -= 1
-
-    io.log(f"{progress:,} predictions processed")
+        else:
+            # Sorted run spilled by a worker (or None if no predictions)
+            run, archives = obj
+            if run is not None:
+                sstore.runs.append(run)
+
+            # Checksums are computed by workers while reading archives
+            checkpoint.add(run, {
+                file: ({**fingerprints[file], **checksums}, accessions)
+                for file, (checksums, accessions) in archives.items()
+            })
+
+    io.log(f"{progress:,} predictions processed ({timings})")
     for p in workers:
         p.join()
 
+    extracted = time.perf_counter()
+    # Index archives while the checkpoint is still usable:
+    # building the final store removes the runs it refers to
+    io.log("indexing archives")
+    index = store.SimpleStore(f"{output}.archives", mode="w", codec="zlib")
+    if previous:
+        for name, value in iter_archives(previous):
+            if os.path.join(indir, name) in unchanged:
+                index.add(name, value)
+
+    for file, (fingerprint, accessions) in checkpoint.iter_batches():
+        index.add(os.path.relpath(file, indir), (fingerprint, accessions))
+
+    index.build()
+
     io.log("building final store")
-    sstore = store.SimpleStore(output, mode="w")
-    sstore.build(iterable=[iter_temp_stores(f) for f in stores],
+    if previous:
+        # Merge with predictions of unchanged archives
+        sstore.reduce_runs(processes)
+        iterable = [
+            ((key, value) for key, value in store.open_store(previous).items()
+             if key not in stale),
+            *[run.iter() for run in sstore.runs]
+        ]
+        sstore.build(iterable=iterable,
+                     buffersize=1000,
+                     fpr=fpr,
+                     verbose=True)
+    else:
+        sstore.build(buffersize=1000,
+                     fpr=fpr,
+                     processes=processes,
+                     verbose=True)
+
+    os.unlink(checkpoint.path)
+
+    if report:
+        with open(report, "wt") as fh:
+            json.dump({
+                "processes": processes,
+                "archives": len(archive_timings),
+                "predictions": progress,
+                "extract": round(extracted - start, 3),
+                "build": round(time.perf_counter() - extracted, 3),
+                "stages": timings.asdict(),
+                "details": [t.asdict() for t in archive_timings]
+            }, fh, indent=2)
+
+    io.log("complete")
+
+
+def merge(inputs: list[str], output: str, codec: str = "none",
+          fpr: float = 0):
+    """Merge stores of predictions extracted separately (e.g. parts)."""
+    io.log("merging AlphaFold stores")
+    inputs = [os.path.abspath(path) for path in inputs]
+    output = os.path.abspath(output)
+    if output in inputs:
+        raise ValueError("output cannot be one of the input stores")
+
+    stores = [store.open_store(path) for path in inputs]
+    sstore = store.SimpleStore(output, mode="w", codec=codec)
+    sstore.build(iterable=[s.items(prefetch=2) for s in stores],
                  buffersize=1000,
+                 fpr=fpr,
                  verbose=True)
-    for f in stores:
-        os.unlink(f)
+
+    for s in stores:
+        s.close()
+
+    io.log("indexing archives")
+    index = store.SimpleStore(f"{output}.archives", mode="w", codec="zlib")
+    index.build(iterable=[store.SimpleStore(f"{path}.archives").items()
+                          for path in inputs])
 
     io.log("complete")
 
 
-def worker(inqueue: mp.Queue, version: int, output: str, outqueue: mp.Queue):
-    sstore = store.SimpleStore(output, mode="w", tempbuffersize=100000)
+def join_key(accession: str, crc64: str) -> str:
+    """Key of a protein in key sets, see export_keys()."""
+    return f"{accession}:{crc64}"
+
+
+def export_keys(input: str, output: str, fpr: float = 0.01):
+    """
+    Write the key set of proteins that pfafbuild can join
+    to a prediction (single-fragment models), so that UniProtKB
+    and Pfam indexes can skip other proteins.
+    False positives only keep a few proteins that are not used.
+    """
+    io.log("exporting keys")
+    sstore = store.open_store(input)
+    keys = (join_key(accession, fragments[0][2])
+            for accession, fragments in sstore.items(prefetch=2)
+            if len(fragments) == 1 and fragments[0][0] == "F1")
+    n = store.write_keyset(output, keys, fpr)
+    sstore.close()
+    io.log(f"\t{n:,}")
+    io.log("complete")
 
+
+def partition(files: list[str], n: int) -> list[list[str]]:
+    """
+    Split archives into n parts of similar total size.
+    The assignment only depends on the paths and sizes of archives,
+    so independent jobs agree on it.
+    """
+    sizes = {file: os.path.getsize(file) for file in files}
+    parts = [[] for _ in range(n)]
+    totals = [0] * n
+    # Largest archives first, each to the smallest part so far
+    for file in sorted(files, key=lambda f: (-sizes[f], f)):
+        i = totals.index(min(totals))
+        parts[i].append(file)
+        totals[i] += sizes[file]
+
+    return parts
+
+
+def worker(inqueue: mp.Queue, version: int, lossy: bool, verify: bool,
+           checksum: bool, output: str, memory: int, outqueue: mp.Queue):
+    # Dump at archive boundaries, so each run contains complete archives
+    sstore = store.SimpleStore(output, mode="w", tempbuffersize=100000,
+                               tempbufferbytes=memory, autodump=False)
+
+    archives = {}
     for file in iter(inqueue.get, None):
-        predictions = extract_tar(file, version)
+        timings = Timings(file)
+        start = time.perf_counter()
+        if checksum:
+            with open(file, "rb") as fh:
+                reader = HashingReader(fh)
+                predictions = extract_tar(reader, version, lossy, verify,
+                                          timings)
+                checksums = {"sha256": reader.hexdigest()}
+        else:
+            predictions = extract_tar(file, version, lossy, verify, timings)
+            checksums = {}
+
+        t = time.perf_counter()
         for accession, fragments in predictions.items():
             sstore.add(accession, fragments)
 
-        outqueue.put(len(predictions))
+        archives[file] = (checksums, list(predictions))
+        full = sstore.is_full()
+        if full:
+            sstore.dump()
+
+        timings.lap("store", t)
+        timings.predictions = len(predictions)
+        timings.elapsed = time.perf_counter() - start
+        outqueue.put(timings)
+
+        if full:
+            outqueue.put((sstore.runs[-1], archives))
+            archives = {}
+
+    if archives:
+        if sstore.tempbuffer:
+            sstore.dump()
+            outqueue.put((sstore.runs[-1], archives))
+        else:
+            outqueue.put((None, archives))
+
+    outqueue.put(None)
+
+
+def get_fingerprint(file: str) -> dict:
+    st = os.stat(file)
+    return {"size": st.st_size, "mtime": st.st_mtime_ns}
+
+
+def get_checksum(file: str) -> str:
+    with open(file, "rb") as fh:
+        return hashlib.file_digest(fh, "sha256").hexdigest()
+
+
+class HashingReader:
+    """Binary file wrapper computing the SHA-256 checksum of data read."""
+
+    def __init__(self, fh: BinaryIO):
+        self.fh = fh
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fh.read(size)
+        self.sha256.update(data)
+        return data
+
+    def hexdigest(self) -> str:
+        # Include data not read by the consumer (e.g. end-of-archive padding)
+        while self.read(1024 * 1024):
+            pass
+
+        return self.sha256.hexdigest()
+
 
-    sstore.build()
-    outqueue.put(output)
+def same_fingerprints(old: dict, new: dict | None) -> bool:
+    if new is None or old["size"] != new["size"]:
+        return False
+    elif "sha256" in old and "sha256" in new:
+        # Content is known: ignore modification times
+        return old["sha256"] == new["sha256"]
 
+    return old["mtime"] == new["mtime"]
 
-def extract_tar(file: str, version: int = 4) -> dict[str, list[tuple]]:
+
+def iter_archives(output: str):
+    """Yield (archive, (fingerprint, accessions)) of a prediction store."""
+    path = f"{output}.archives"
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"{path} not found: "
+                                f"cannot update {output} incrementally")
+
+    yield from store.SimpleStore(path).items()
+
+
+@dataclass
+class Timings:
+    """Cumulative time (seconds) and bytes processed by each stage."""
+    archive: str | None = None
+    predictions: int = 0
+    elapsed: float = 0
+    seconds: dict[str, float] = field(
+        default_factory=lambda: dict.fromkeys(STAGES, 0.0)
+    )
+    bytes: dict[str, int] = field(
+        default_factory=lambda: dict.fromkeys(STAGES, 0)
+    )
+
+    def lap(self, stage: str, since: float, size: int = 0) -> float:
+        now = time.perf_counter()
+        self.seconds[stage] += now - since
+        self.bytes[stage] += size
+        return now
+
+    def update(self, other: "Timings"):
+        self.elapsed += other.elapsed
+        for stage in STAGES:
+            self.seconds[stage] += other.seconds[stage]
+            self.bytes[stage] += other.bytes[stage]
+
+    def asdict(self) -> dict:
+        obj = {}
+        if self.archive is not None:
+            obj.update(archive=self.archive,
+                       predictions=self.predictions,
+                       seconds=round(self.elapsed, 3))
+
+        for stage in STAGES:
+            obj[stage] = {"seconds": round(self.seconds[stage], 3),
+                          "bytes": self.bytes[stage]}
+
+        return obj
+
+    def __str__(self) -> str:
+        total = sum(self.seconds.values()) or 1
+        return ", ".join(f"{stage}: {self.seconds[stage] / total:.0%}"
+                         for stage in STAGES)
+
+
+def extract_tar(file: str | BinaryIO, version: int = 4, lossy: bool = False,
+                verify: bool = False,
+                timings: Timings | None = None) -> dict[str, list[tuple]]:
     """
+    By default, the sequence and pLDDT scores are read from the mmCIF
+    header, before the atom_site loop. If `verify` is True,
+    pLDDT scores of the confidence JSON file are checked against
+    the B-factors of atoms.
+
+    The archive (path or file object, possibly compressed) is read
+    as a stream, in a single pass: the JSON and mmCIF files of a model
+    are paired as they are read, and other members are skipped.
+
     In the case of proteins longer than 2700 amino acids (aa),
     AlphaFold provides 1400aa long, overlapping fragments.
     For example, Titin has predicted fragment structures named
@@ -91,49 +459,118 @@ def extract_tar(file: str, version: int = 4) -> dict[str, list[tuple]]:
     for the human proteome in these proteome archive files,
     not on the website.
     (https://alphafold.ebi.ac.uk/download)
-    """
-    regex = re.compile(r"(AF-[A-Z\d]+-F\d+)-confidence_v(\d+).json.gz")
-    predictions = {}
-    with tarfile.open(file) as tar:
-        for name in tar.getnames():
-            match = regex.fullmatch(name)
-
-            if match:
-                model_id, model_version = match.groups()
-
-                if int(model_version) != version:
-                    continue
 
-                _, accession, fragment = model_id.split("-")
+    If `timings` is passed, the time spent in each stage is added to it.
+    """
+    if timings is None:
+        timings = Timings()
 
-                br = tar.extractfile(name)
+    regex = re.compile(r"(AF-[A-Z\d]+-F\d+)-(confidence|model)_v(\d+)"
+                       r"\.(?:json|cif)\.gz")
+    predictions = {}
+    # Models of the archive, checksummed once it is read
+    models = []
+    sequences = []
+    # Verify mode only: first file of a model waiting for the other one
+    pending_json = {}
+    pending_cif = {}
+
+    if isinstance(file, str):
+        tar = tarfile.open(file, mode="r|*")
+    else:
+        tar = tarfile.open(fileobj=file, mode="r|*")
+
+    with tar:
+        t = time.perf_counter()
+        for member in tar:
+            match = regex.fullmatch(member.name)
+            if not match:
+                continue
+
+            model_id, kind, model_version = match.groups()
+            if int(model_version) != version:
+                continue
+            elif kind == "confidence" and not verify:
+                continue
+
+            br = tar.extractfile(member)
+            if kind == "confidence":
                 content = br.read()
+                t = timings.lap("tar", t, len(content))
                 json_str = gzip.decompress(content).decode("utf-8")
+                t = timings.lap("gzip", t, len(json_str))
                 data = json.loads(json_str)
                 # Other keys: residueNumber, confidenceCategory
                 scores = data["confidenceScore"]
+                t = timings.lap("json", t)
 
-                name = f"{model_id}-model_v{model_version}.cif.gz"
-                br = tar.extractfile(name)
+                try:
+                    sequence, scores_alt = pending_cif.pop(model_id)
+                except KeyError:
+                    pending_json[model_id] = scores
+                    continue
+            elif verify:
                 content = br.read()
+                t = timings.lap("tar", t, len(content))
                 cif = gzip.decompress(content).decode("utf-8")
+                t = timings.lap("gzip", t, len(cif))
                 sequence, scores_alt = parse_cif(cif)
+                t = timings.lap("cif", t)
 
-                if len(sequence) != len(scores) or scores != scores_alt:
-                    io.log(f"error in {name} ({file})")
-                    continue
-
-                crc64 = crc64iso.crc64(sequence)
                 try:
-                    obj = predictions[accession]
+                    scores = pending_json.pop(model_id)
                 except KeyError:
-                    obj = predictions[accession] = []
+                    pending_cif[model_id] = sequence, scores_alt
+                    continue
+            else:
+                t = timings.lap("tar", t)
+                with gzip.open(br, "rt") as fh:
+                    sequence, scores = parse_cif_header(fh, model_id)
+
+                t = timings.lap("cif", t, br.tell())
+
+                scores_alt = scores
+
+            if (not sequence or len(sequence) != len(scores) or
+                    scores != scores_alt):
+                io.log(f"error in {model_id} ({file})")
+                continue
+
+            _, accession, fragment = model_id.split("-")
+            models.append((accession, fragment, pack_scores(scores, lossy)))
+            sequences.append(sequence)
+            t = timings.lap("store", t)
+
+    for model_id in [*pending_json, *pending_cif]:
+        io.log(f"error in {model_id} ({file}): incomplete model")
 
-                obj.append((fragment, scores, crc64))
+    # Sequences of the archive are checksummed together
+    t = time.perf_counter()
+    checksums = crc64_many(sequences)
+    t = timings.lap("crc64", t, sum(map(len, sequences)))
+    for (accession, fragment, scores), crc in zip(models, checksums):
+        try:
+            obj = predictions[accession]
+        except KeyError:
+            obj = predictions[accession] = []
 
+        obj.append((fragment, scores, crc))
+
+    timings.lap("store", t)
     return predictions
 
 
+def pack_scores(scores: list[float], lossy: bool = False) -> array:
+    if lossy:
+        return array("B", [round(score) for score in scores])
+
+    return array("H", [round(score * SCALES["H"]) for score in scores])
+
+
+def get_scale(scores: array) -> int:
+    return SCALES[scores.typecode]
+
+
 def parse_cif(cif: str) -> tuple[str, list[float]]:
     sequence = ""
     scores = []
@@ -152,6 +589,102 @@ def parse_cif(cif: str) -> tuple[str, list[float]]:
     return sequence.upper(), scores
 
 
-def iter_temp_stores(file: str):
-    sstore = store.SimpleStore(file, mode="r")
-    yield from sstore.items()
+def parse_cif_header(fh, model_id: str = "") -> tuple[str, list[float]]:
+    """
+    Read the UniProtKB sequence from _struct_ref.pdbx_seq_one_letter_code
+    and the pLDDT scores from the _ma_qa_metric_local loop,
+    without tokenizing atoms. If the reference sequence is missing,
+    it is rebuilt from the residues of the _entity_poly_seq loop.
+    """
+    reference = None
+    begin = 1
+    residues = None
+    scores = None
+    for name, value in iter_cif(fh,
+                                loops={"_entity_poly_seq",
+                                       "_ma_qa_metric_local"},
+                                items={"_struct_ref.pdbx_align_begin",
+                                       "_struct_ref.pdbx_seq_one_letter_code"}):
+        if name == "_struct_ref.pdbx_seq_one_letter_code":
+            reference = value
+        elif name == "_struct_ref.pdbx_align_begin":
+            begin = int(value) if value.isdigit() else 1
+        elif name == "_entity_poly_seq":
+            columns, rows = value
+            i = columns.index("mon_id")
+            residues = [row[i] for row in rows]
+        else:
+            columns, rows = value
+            i = columns.index("metric_value")
+            scores = [float(row[i]) for row in rows]
+
+        if reference is not None and scores is not None:
+            break
+
+    scores = scores or []
+    if reference is not None:
+        if len(reference) > len(scores) > 0:
+            # Model of a fragment of the reference sequence
+            reference = reference[begin - 1:begin - 1 + len(scores)]
+
+        return reference, scores
+    elif residues is not None:
+        unknown = sorted({r for r in residues if r not in THREE_TO_ONE})
+        if unknown:
+            io.log(f"{model_id}: no reference sequence, "
+                   f"unknown residues {', '.join(unknown)} read as X")
+
+        sequence = "".join(THREE_TO_ONE.get(r, "X") for r in residues)
+        return sequence, scores
+
+    return "", scores
+
+
+def iter_cif(fh, loops: set[str], items: set[str]):
+    """
+    Yield (category, (columns, rows)) of the given loops,
+    and (name, value) of the given single items in an mmCIF file.
+    Values of multi-line text fields are joined without line breaks.
+    """
+    lines = iter(fh)
+    for line in lines:
+        if line[:5] == "loop_":
+            line = next(lines, "")
+            category = line.split(".", 1)[0]
+            if category not in loops:
+                # Skip column names
+                while line[:1] == "_":
+                    line = next(lines, "")
+
+                continue
+
+            columns = []
+            while line[:1] == "_":
+                columns.append(line.split(".", 1)[1].strip())
+                line = next(lines, "")
+
+            rows = []
+            while line and line[:1] not in ("#", "_") and line[:5] != "loop_":
+                rows.append(line.split())
+                line = next(lines, "")
+
+            yield category, (columns, rows)
+        elif line[:1] == "_":
+            name, _, value = line.strip().partition(" ")
+            if name not in items:
+                continue
+
+            value = value.strip()
+            if not value:
+                value = next(lines, "").rstrip("\n")
+                if value[:1] == ";":
+                    text = [value[1:].strip()]
+                    for line in lines:
+                        if line[:1] == ";":
+                            break
+
+                        text.append(line.strip())
+
+                    value = "".join(text)
+
+            yield name, value.strip().strip("'\"")
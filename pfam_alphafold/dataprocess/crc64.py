@@ -0,0 +1,139 @@
+"""
+CRC-64 checksum of ISO 3309 (as used by UniProtKB and InterPro),
+compatible with crc64iso.crc64().
+
+The generator polynomial P = x^64 + x^4 + x^3 + x + 1 is sparse,
+and so are its powers x^(64m) mod P = x^4m + x^3m + x^m + 1 (m = 2^k).
+The message, read as a single integer, is folded onto itself
+with a few shifts and XORs of Python integers, each fold removing
+60m bits without changing the remainder modulo P.
+The remaining bytes (fewer than 31) are processed with a lookup table.
+
+crc64_many() shares the smaller folds between sequences: sequences
+of similar lengths are packed into one integer, one slot each,
+and folded together down to 64 bits per slot.
+"""
+from typing import Iterable
+
+# Reflected polynomial
+POLY = 0xD800000000000000
+
+
+def _make_table() -> list[int]:
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ POLY if crc & 1 else crc >> 1
+
+        table.append(crc)
+
+    return table
+
+
+TABLE = _make_table()
+
+# (minimum length in bits, bits removed, mask, m) of each fold, largest first.
+# m is even so that folds remove whole bytes.
+FOLDS = [(124 * m, 60 * m, (1 << 60 * m) - 1, m)
+         for m in [1 << k for k in range(20, 0, -1)]]
+
+# crc64_many() folds each sequence down to fewer than GROUP_BITS bits,
+# then groups of GROUP_SIZE sequences together (slots of 124 bytes
+# at most, so a group's integer stays small enough for the CPU caches)
+GROUP_BITS = 992
+GROUP_SIZE = 256
+# Folds shared by a group: slots are never converted to bytes
+# until the end, so m can be odd
+GROUP_FOLDS = [(minbits, size, m)
+               for minbits, size, _, m in FOLDS
+               if minbits < GROUP_BITS] + [(124, 60, 1)]
+
+
+def _fold(data: bytes, minbits: int = 0) -> bytes:
+    """Apply folds for messages of at least `minbits` bits."""
+    n = len(data) * 8
+    if n >= max(minbits, FOLDS[-1][0]):
+        value = int.from_bytes(data, "little")
+        for minbits_, size, mask, m in FOLDS:
+            if minbits_ < minbits:
+                break
+
+            while n >= minbits_:
+                low = value & mask
+                value = ((value >> size) ^ low ^ (low << m) ^
+                         (low << 3 * m) ^ (low << 4 * m))
+                n -= size
+
+        data = value.to_bytes(n // 8, "little")
+
+    return data
+
+
+def crc64(sequence: str) -> str:
+    crc = 0
+    for b in _fold(sequence.encode("utf-8")):
+        crc = (crc >> 8) ^ TABLE[(crc ^ b) & 0xFF]
+
+    return f"{crc:016X}"
+
+
+def crc64_many(sequences: Iterable[str]) -> list[str]:
+    """
+    Checksum many sequences, e.g. all the models of an archive,
+    faster than calling crc64() on each.
+    """
+    data = [_fold(seq.encode("utf-8"), GROUP_BITS) for seq in sequences]
+    checksums = [""] * len(data)
+    # Sequences of similar lengths waste less space in slots
+    order = sorted(range(len(data)), key=lambda i: len(data[i]))
+    for start in range(0, len(order), GROUP_SIZE):
+        group = order[start:start + GROUP_SIZE]
+        for i, crc in zip(group, _crc64_group([data[i] for i in group])):
+            checksums[i] = crc
+
+    return checksums
+
+
+def _crc64_group(items: list[bytes]) -> list[str]:
+    """Checksum messages sorted by length, one slot each."""
+    count = len(items)
+    # Leading null bytes do not change checksums: messages are aligned
+    # to the end of their slot, and have the same length
+    width = max(len(items[-1]), 8)
+    n = width * 8
+    data = b"".join([item.rjust(width, b"\0") for item in items])
+    value = int.from_bytes(data, "little")
+    # Lowest bit of each slot
+    ones = int.from_bytes((b"\1" + b"\0" * (width - 1)) * count, "little")
+    for minbits, size, m in GROUP_FOLDS:
+        # The low bits of every slot are cleared before shifting,
+        # so slots do not overlap
+        mask = (ones << size) - ones
+        while n >= minbits:
+            low = value & mask
+            high = low ^ (low << m)
+            value = ((value ^ low) >> size) ^ high ^ (high << 3 * m)
+            n -= size
+
+    if n > 64:
+        # x^64 = x^4 + x^3 + x + 1 (mod P): the low n-64 bits
+        # are folded into the remaining 64 bits
+        size = n - 64
+        low = value & ((ones << size) - ones)
+        high = low << (60 - size)
+        high ^= high << 1
+        value = ((value ^ low) >> size) ^ high ^ (high << 3)
+    else:
+        value <<= 64 - n
+
+    data = value.to_bytes(count * width, "little")
+    checksums = []
+    for i in range(0, len(data), width):
+        crc = 0
+        for b in data[i:i + 8]:
+            crc = (crc >> 8) ^ TABLE[(crc ^ b) & 0xFF]
+
+        checksums.append(f"{crc:016X}")
+
+    return checksums
@@ -4,7 +4,7 @@ import os
 import sqlite3
 import sys
 
-from . import io, store
+from . import alphafold, io, records, store
 from .models import Entry
 
 
@@ -19,10 +19,28 @@ def build(alphafold_file: str, pfam_file: str, uniprot_file: str,
                   file=sys.stderr)
             sys.exit(1)
 
+    stores = []
+    for path, cmd in [(uniprot_file, "uniprot"),
+                      (pfam_file, "pfam"),
+                      (alphafold_file, "alphafold")]:
+        try:
+            stores.append(store.open_store(path))
+        except ValueError:
+            print(f"Error: {path} uses an outdated format. "
+                  f"Run 'pfafindex {cmd}' to recreate it.",
+                  file=sys.stderr)
+            sys.exit(1)
+
     io.log("building database")
-    proteins = store.SimpleStore(uniprot_file)
-    pfams = store.SimpleStore(pfam_file)
-    structures = store.SimpleStore(alphafold_file)
+    proteins, pfams, structures = stores
+    if "families" not in pfams.metadata:
+        print(f"Error: {pfam_file} uses an outdated format. "
+              f"Run 'pfafindex pfam' to recreate it.",
+              file=sys.stderr)
+        sys.exit(1)
+
+    # Hits refer to families by index
+    families = pfams.metadata["families"]
 
     try:
         os.unlink(database)
@@ -105,27 +123,24 @@ def build(alphafold_file: str, pfam_file: str, uniprot_file: str,
 
     progress = 0
     step = milestone = 10000000
-    for uniprot_acc, protein in proteins.items():
+    # All stores are sorted by accession: scan them together in one pass
+    joined = store.join(proteins, structures, pfams, prefetch=2)
+    for uniprot_acc, protein, fragments, _protein in joined:
+        protein = records.decode(protein)
         plddt = []
-        try:
-            fragments = structures[uniprot_acc]
-        except KeyError:
-            pass
-        else:
-            if len(fragments) == 1:
-                fragment, scores, crc64 = fragments[0]
-                if fragment == "F1" and protein.crc64 == crc64:
-                    plddt = scores
+        if fragments is not None and len(fragments) == 1:
+            fragment, scores, crc64 = fragments[0]
+            if fragment == "F1" and protein.crc64 == crc64:
+                plddt = scores
 
         if plddt:
-            glo_avg_plddt = sum(plddt) / len(plddt)
+            # Scores are stored as scaled integers
+            scale = alphafold.get_scale(plddt)
+            glo_avg_plddt = sum(plddt) / len(plddt) / scale
 
             pfam_hits = []
-            try:
-                _protein = pfams[uniprot_acc]
-            except KeyError:
-                pass
-            else:
+            if _protein is not None:
+                _protein = records.decode(_protein)
                 if protein.crc64 == _protein.crc64:
                     pfam_hits = _protein.hits
 
@@ -184,21 +199,22 @@ def build(alphafold_file: str, pfam_file: str, uniprot_file: str,
             if protein.complete:
                 af_entry.dists[f"{key}_nofrags"][index] += 1
 
-            for match in pfam_hits:
+            for family_index, locations in pfam_hits:
                 try:
-                    entry = entries[match["id"]]
+                    entry = entries[family_index]
                 except KeyError:
-                    entry = entries[match["id"]] = Entry.fromdict(match)
+                    entry = Entry(*families[family_index])
+                    entries[family_index] = entry
 
                 entry.num_alphafold += 1
                 dom_plddt = [None] * protein.length
 
-                for start, end in match["locations"]:
+                for start, end in zip(locations[0::2], locations[1::2]):
                     for i in range(start - 1, end):
                         dom_plddt[i] = plddt[i]
 
                 dom_plddt = [v for v in dom_plddt if v is not None]
-                dom_avg_plddt = sum(dom_plddt) / len(dom_plddt)
+                dom_avg_plddt = sum(dom_plddt) / len(dom_plddt) / scale
                 entry.glo_score += glo_avg_plddt
                 entry.dom_score += dom_avg_plddt
 
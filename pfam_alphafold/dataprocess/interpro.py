@@ -1,165 +1,366 @@
 import gzip
-import re
+import multiprocessing as mp
+import os
+from array import array
+from typing import Callable, Iterable
 from xml.etree import ElementTree
 
-from . import io, models, pfam, store
+from . import alphafold, io, models, pfam, records, store
 
+# Size of batches of proteins parsed by workers
+BATCH_SIZE = 8 * 1024 ** 2
+# Size of the slices of a batch fed to the XML parser
+XML_BUFSIZE = 1024 ** 2
+# Pfam families by accession, with their index in the DAT file
+Families = dict[str, tuple[int, models.Entry]]
 
-def parse_xml(file: str):
+
+def iter_batches(file: str, size: int = BATCH_SIZE):
+    """Yield batches of complete <protein> elements, as bytes."""
     if file.lower().endswith(".gz"):
         _open = gzip.open
     else:
         _open = open
 
-    with _open(file, mode="rt") as fh:
-        reg = re.compile(r"<protein")
-        buffer = ""
-        i = -1
-        while chunk := fh.read(1000):
-            buffer += chunk
-
-            for m in reg.finditer(buffer):
-                j = m.start()
+    with _open(file, mode="rb") as fh:
+        buffer = b""
+        while data := fh.read(size):
+            buffer += data
+            i = buffer.find(b"<protein")
+            j = buffer.rfind(b"</protein>")
+            if 0 <= i < j:
+                j += len(b"</protein>")
+                yield buffer[i:j]
+                buffer = buffer[j:]
 
-                if j > i >= 0:
-                    try:
-                        yield ElementTree.fromstring(buffer[i:j])
-                    except Exception as exc:
-                        print(i, j, buffer[i:j])
-                        raise exc
 
-                i = j
+def parse_batch(batch: bytes):
+    """
+    Yield the <protein> elements of a batch, parsed incrementally.
+    Each element is cleared once the caller is done with it,
+    so memory does not grow with the size of the batch.
+    """
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    parser.feed(b"<batch>")
+    root = None
+    for i in range(0, len(batch), XML_BUFSIZE):
+        parser.feed(batch[i:i + XML_BUFSIZE])
+        for event, elem in parser.read_events():
+            if root is None:
+                root = elem
+            elif event == "end" and elem.tag == "protein":
+                yield elem
+                # Detach processed proteins from the root
+                root.clear()
 
-            if i >= 0:
-                buffer = buffer[i:]
-                i = 0
+    parser.feed(b"</batch>")
+    parser.close()
 
-        j = re.search(r"</interpro(extra|match)>", buffer).start()
-        yield ElementTree.fromstring(buffer[i:j])
 
-
-def index_pfam(dat_file: str, xml_file: str, output: str):
-    io.log("loading Pfam families")
+def load_families(dat_file: str) -> Families:
     families = {}
-    for fam in pfam.parse_dat_file(dat_file):
-        families[fam.accession] = fam
+    for i, fam in enumerate(pfam.parse_dat_file(dat_file)):
+        families[fam.accession] = (i, fam)
 
-    io.log("parsing Pfam matches")
-    sstore = store.SimpleStore(output, "w")
+    return families
 
-    n = 0
-    for elem in parse_xml(xml_file):
-        uniprot_acc = elem.attrib["id"]
-        if "-" in uniprot_acc:
+
+def get_pfam_hits(elem: ElementTree.Element,
+                  families: Families) -> list[tuple[int, array]]:
+    """
+    Return hits as (family index, start/end positions),
+    with family details stored once in the metadata of the store.
+    """
+    hits = []
+    for match in elem.findall("match"):
+        try:
+            family_index, _ = families[match.attrib["id"]]
+        except KeyError:
             continue
+        else:
+            locations = array("i")
+            for loc in match.findall("lcn"):
+                fragments = loc.get("fragments")
+                if fragments:
+                    for fragment in fragments.split(","):
+                        start, end, _ = fragment.split("-")
+                        locations.append(int(start))
+                        locations.append(int(end))
+                else:
+                    locations.append(int(loc.attrib["start"]))
+                    locations.append(int(loc.attrib["end"]))
+
+            hits.append((family_index, locations))
+
+    return hits
+
+
+def get_prediction_hits(elem: ElementTree.Element,
+                        families: Families) -> list[dict]:
+    hits = []
+    for match in elem.findall("match"):
+        database = match.attrib["dbname"]
+        locations = []
+        if database == "MOBIDBLT":
+            match_id = "MobiDB-lite"
+            for loc in match.findall("lcn"):
+                if (loc.attrib["sequence-feature"] ==
+                        "Consensus Disorder Prediction"):
+                    locations.append((int(loc.attrib["start"]),
+                                      int(loc.attrib["end"])))
 
-        protein = models.Protein(identifier=elem.attrib["name"],
-                                 length=int(elem.attrib["length"]),
-                                 accession=uniprot_acc,
-                                 crc64=elem.attrib["crc64"])
-        for match in elem.findall("match"):
+            name = descr = None
+            _type = "Disorder Prediction"
+        elif database == "PFAM-N":
             match_id = match.attrib["id"]
+            for loc in match.findall("lcn"):
+                locations.append((int(loc.attrib["start"]),
+                                  int(loc.attrib["end"])))
+
             try:
-                family = families[match_id]
+                _, family = families[match_id]
             except KeyError:
-                continue
+                name = descr = _type = None
             else:
-                locations = []
-                for loc in match.findall("lcn"):
-                    fragments = loc.get("fragments")
-                    if fragments:
-                        for fragment in fragments.split(","):
-                            start, end, _ = fragment.split("-")
-                            locations.append((int(start), int(end)))
-                    else:
-                        locations.append((int(loc.attrib["start"]),
-                                          int(loc.attrib["end"])))
-
-                protein.hits.append({
-                    "id": match_id,
-                    "name": family.name,
-                    "description": family.description,
-                    "type": family.type,
-                    "locations": locations
-                })
-
-        if protein.hits:
-            sstore.add(protein.accession, protein)
-
-        n += 1
-        if n % 1e7 == 0:
-            io.log(f"\t{n:,}")
+                name = family.name
+                descr = family.description
+                _type = family.type
+        else:
+            continue
+
+        hits.append({
+            "id": match_id,
+            "name": name,
+            "description": descr,
+            "type": _type,
+            "locations": locations
+        })
+
+    return hits
+
+
+def add_protein(sstore: store.SimpleStore, elem: ElementTree.Element,
+                get_hits: Callable, families: Families,
+                record_codec: records.RecordCodec,
+                keep: store.BloomFilter | None = None) -> bool:
+    uniprot_acc = elem.attrib["id"]
+    if "-" in uniprot_acc:
+        return False
+    elif (keep is not None and
+            alphafold.join_key(uniprot_acc, elem.attrib["crc64"]) not in keep):
+        return False
+
+    protein = models.Protein(identifier=elem.attrib["name"],
+                             length=int(elem.attrib["length"]),
+                             accession=uniprot_acc,
+                             crc64=elem.attrib["crc64"])
+    protein.hits = get_hits(elem, families)
+    if protein.hits:
+        sstore.add(protein.accession, record_codec.encode(protein))
+
+    return True
+
+
+def index_pfam(dat_file: str, xml_file: str, output: str,
+               codec: str = "none", minimal: bool = False,
+               memory: int = 0, processes: int = 1,
+               keep_keys: str | None = None, resume: bool = False,
+               fpr: float = 0):
+    record_codec = records.PFAM_MIN if minimal else records.PFAM
+    index(dat_file, xml_file, output, get_pfam_hits, record_codec,
+          codec=codec, memory=memory, processes=processes,
+          keep_keys=keep_keys, resume=resume, fpr=fpr)
+
+
+def index_predictions(dat_file: str, xml_file: str, output: str,
+                      codec: str = "none", minimal: bool = False,
+                      memory: int = 0, processes: int = 1,
+                      keep_keys: str | None = None, resume: bool = False,
+                      fpr: float = 0):
+    record_codec = records.MATCHES_MIN if minimal else records.MATCHES
+    index(dat_file, xml_file, output, get_prediction_hits, record_codec,
+          codec=codec, memory=memory, processes=processes,
+          keep_keys=keep_keys, resume=resume, fpr=fpr)
+
+
+def index(dat_file: str, xml_file: str, output: str, get_hits: Callable,
+          record_codec: records.RecordCodec, codec: str = "none",
+          memory: int = 0, processes: int = 1,
+          keep_keys: str | None = None, resume: bool = False,
+          fpr: float = 0):
+    """
+    Index proteins with hits.
+    If `keep_keys` is set, only proteins in this key set
+    (see alphafold.export_keys) are indexed.
+    Sorted runs are recorded in a checkpoint with the batches of proteins
+    they contain: if `resume` is True, batches already processed
+    by an interrupted job are skipped.
+    """
+    io.log("loading Pfam families")
+    families = load_families(dat_file)
+
+    io.log("parsing matches")
+    sstore = store.SimpleStore(output, "w", codec=codec,
+                               tempbufferbytes=memory)
+    # Hits refer to families by their index in this list
+    sstore.metadata["families"] = [
+        (fam.accession, fam.name, fam.description, fam.type)
+        for _, fam in families.values()
+    ]
+    checkpoint = store.Checkpoint(f"{sstore.path}.progress.jsonl", {
+        "files": [os.path.abspath(dat_file), os.path.abspath(xml_file)],
+        "batch_size": BATCH_SIZE,
+        "hits": get_hits.__name__,
+        "schema": record_codec.schema_id,
+        "keep_keys": keep_keys,
+    })
+    if checkpoint.start(resume):
+        io.log(f"resuming: {len(checkpoint.batches):,} batches "
+               f"already processed")
+
+    if processes > 1:
+        n = index_parallel(xml_file, sstore, get_hits, families,
+                           record_codec, memory, processes, keep_keys,
+                           checkpoint)
+    else:
+        # Dump at batch boundaries, so each run contains complete batches
+        writer = store.SimpleStore(output, "w", tempbufferbytes=memory,
+                                   autodump=False)
+        keep = store.load_keyset(keep_keys) if keep_keys else None
+        batches = iter_pending_batches(xml_file, checkpoint.batches)
+        n = 0
+        milestone = step = 1e7
+        for obj in add_batches(writer, batches, get_hits, families,
+                               record_codec, keep):
+            if isinstance(obj, int):
+                n += obj
+                if n >= milestone:
+                    io.log(f"\t{n:,}")
+                    milestone += step
+            else:
+                checkpoint.add(*obj)
 
     io.log(f"\t{n:,}")
     io.log("indexing")
-    sstore.build(verbose=True)
+    sstore.runs.extend(checkpoint.runs)
+    sstore.build(fpr=fpr, processes=processes, verbose=True)
+    os.unlink(checkpoint.path)
     io.log("complete")
 
 
-def index_predictions(dat_file: str, xml_file: str, output: str):
-    io.log("loading Pfam families")
-    families = {}
-    for fam in pfam.parse_dat_file(dat_file):
-        families[fam.accession] = fam
+def iter_pending_batches(file: str, done: set[str]):
+    """Yield (batch ID, batch) for batches not already processed."""
+    for i, batch in enumerate(iter_batches(file)):
+        batch_id = str(i)
+        if batch_id not in done:
+            yield batch_id, batch
 
-    io.log("parsing predictions")
-    sstore = store.SimpleStore(output, "w")
 
-    n = 0
-    for elem in parse_xml(xml_file):
-        uniprot_acc = elem.attrib["id"]
-        if "-" in uniprot_acc:
-            continue
+def add_batches(sstore: store.SimpleStore, batches: Iterable,
+                get_hits: Callable, families: Families,
+                record_codec: records.RecordCodec,
+                keep: store.BloomFilter | None):
+    """
+    Add the proteins of (batch ID, batch) batches to a store
+    that is not dumped automatically. Yield the number of proteins
+    added for each batch, and (sorted run, batch IDs)
+    once the proteins of complete batches are dumped.
+    """
+    batch_ids = []
+    for batch_id, batch in batches:
+        n = 0
+        for elem in parse_batch(batch):
+            if add_protein(sstore, elem, get_hits, families, record_codec,
+                           keep):
+                n += 1
 
-        protein = models.Protein(identifier=elem.attrib["name"],
-                                 length=int(elem.attrib["length"]),
-                                 accession=uniprot_acc,
-                                 crc64=elem.attrib["crc64"])
-        for match in elem.findall("match"):
-            database = match.attrib["dbname"]
-            locations = []
-            if database == "MOBIDBLT":
-                match_id = "MobiDB-lite"
-                for loc in match.findall("lcn"):
-                    if (loc.attrib["sequence-feature"] ==
-                            "Consensus Disorder Prediction"):
-                        locations.append((int(loc.attrib["start"]),
-                                          int(loc.attrib["end"])))
-
-                name = descr = None
-                _type = "Disorder Prediction"
-            elif database == "PFAM-N":
-                match_id = match.attrib["id"]
-                for loc in match.findall("lcn"):
-                    locations.append((int(loc.attrib["start"]),
-                                      int(loc.attrib["end"])))
+        yield n
+        batch_ids.append(batch_id)
+        if sstore.is_full():
+            sstore.dump()
+            yield sstore.runs[-1], batch_ids
+            batch_ids = []
 
-                try:
-                    family = families[match_id]
-                except KeyError:
-                    name = descr = _type = None
-                else:
-                    name = family.name
-                    descr = family.description
-                    _type = family.type
+    if batch_ids:
+        if sstore.tempbuffer:
+            sstore.dump()
+            yield sstore.runs[-1], batch_ids
+        else:
+            # Batches without hits are recorded as well
+            yield None, batch_ids
+
+
+def index_parallel(xml_file: str, sstore: store.SimpleStore,
+                   get_hits: Callable, families: Families,
+                   record_codec: records.RecordCodec, memory: int,
+                   processes: int, keep_keys: str | None,
+                   checkpoint: store.Checkpoint) -> int:
+    """
+    Read the XML file in the main process, and parse batches
+    of proteins in a pool of workers, each writing its own sorted runs.
+    """
+    num_workers = max(1, processes - 1)
+    # Bound the number of batches waiting to be parsed
+    batchqueue = mp.Queue(maxsize=2 * num_workers)
+    outqueue = mp.Queue()
+
+    workers = []
+    for _ in range(num_workers):
+        p = mp.Process(target=worker,
+                       args=(batchqueue, sstore.path, get_hits, families,
+                             record_codec.schema_id, memory // num_workers,
+                             keep_keys, outqueue))
+        p.start()
+        workers.append(p)
+
+    n = 0
+    milestone = step = 1e7
+    for batch in iter_pending_batches(xml_file, checkpoint.batches):
+        batchqueue.put(batch)
+
+        while not outqueue.empty():
+            obj = outqueue.get()
+            if isinstance(obj, int):
+                n += obj
             else:
-                continue
+                # Sorted run spilled by a worker, and the batches it contains
+                checkpoint.add(*obj)
 
-            protein.hits.append({
-                "id": match_id,
-                "name": name,
-                "description": descr,
-                "type": _type,
-                "locations": locations
-            })
+        if n >= milestone:
+            io.log(f"\t{n:,}")
+            milestone += step
 
-        if protein.hits:
-            sstore.add(protein.accession, protein)
+    for _ in workers:
+        batchqueue.put(None)
 
-        n += 1
-        if n % 1e7 == 0:
-            io.log(f"{n:,} proteins processed")
+    running = len(workers)
+    while running > 0:
+        obj = outqueue.get()
+        if isinstance(obj, int):
+            n += obj
+        elif obj is None:
+            running -= 1
+        else:
+            checkpoint.add(*obj)
 
-    io.log(f"{n:,} proteins processed")
-    sstore.build(verbose=True)
-    io.log("complete")
+    for p in workers:
+        p.join()
+
+    return n
+
+
+def worker(batchqueue: mp.Queue, output: str, get_hits: Callable,
+           families: Families, schema_id: int, memory: int,
+           keep_keys: str | None, outqueue: mp.Queue):
+    # Codecs cannot be pickled (they hold a Struct and a generated class)
+    record_codec = records.CODECS[schema_id]
+    # Dump at batch boundaries, so each run contains complete batches
+    sstore = store.SimpleStore(output, "w", tempbufferbytes=memory,
+                               autodump=False)
+    # Each worker maps the key set: pages are shared by the OS
+    keep = store.load_keyset(keep_keys) if keep_keys else None
+    for obj in add_batches(sstore, iter(batchqueue.get, None), get_hits,
+                           families, record_codec, keep):
+        outqueue.put(obj)
+
+    outqueue.put(None)
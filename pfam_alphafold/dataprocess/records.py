@@ -0,0 +1,211 @@
+import pickle
+import struct
+import sys
+from array import array
+from collections import namedtuple
+from typing import Any
+
+# Field kinds:
+#   bool:    stored in the fixed-size part
+#   int:     unsigned 32-bit integer, stored in the fixed-size part
+#   str:     UTF-8 string, stored in the text part
+#   istr:    same as str, but interned when decoded
+#   strlist: list of interned strings, stored in the text part
+#   obj:     any picklable object, stored after the text part
+#   hits:    list of (family index, array of int32 start/end positions),
+#            stored after the text part as a flat int32 array
+FIXED_KINDS = {"bool": "?", "int": "I"}
+TEXT_KINDS = {"str", "istr", "strlist"}
+# Separators of text fields, and of items in a list
+SEP = "\x1f"
+ITEM_SEP = "\x1e"
+NONE = "\x00"
+# Same, for text fields that are already encoded
+SEP_BYTES = SEP.encode()
+ITEM_SEP_BYTES = ITEM_SEP.encode()
+NONE_BYTES = NONE.encode()
+
+
+def encode_hits(hits: list[tuple[int, array]]) -> bytes:
+    values = array("i")
+    for family, locations in hits:
+        values.append(family)
+        values.append(len(locations))
+        values.extend(locations)
+
+    return values.tobytes()
+
+
+def decode_hits(data: bytes) -> list[tuple[int, array]]:
+    values = array("i", data)
+    hits = []
+    i = 0
+    while i < len(values):
+        family = values[i]
+        j = i + 2 + values[i + 1]
+        hits.append((family, values[i + 2:j]))
+        i = j
+
+    return hits
+
+
+# Kind -> (encode, decode) of fields stored after the text part
+BINARY_KINDS = {
+    "obj": (pickle.dumps, pickle.loads),
+    "hits": (encode_hits, decode_hits),
+}
+
+
+class RecordCodec:
+    """
+    Binary encoding of objects as a fixed-size struct (schema ID,
+    numeric fields, length of the text part, length of each binary field),
+    followed by the text fields (UTF-8, separated by SEP),
+    and by the binary fields (pickled objects, hits).
+    Records are decoded as named tuples, with fields grouped by kind.
+    """
+
+    def __init__(self, schema_id: int, name: str,
+                 fields: list[tuple[str, str]]):
+        self.schema_id = schema_id
+        self.fixed = [name for name, kind in fields if kind in FIXED_KINDS]
+        self.text = [(name, kind) for name, kind in fields
+                     if kind in TEXT_KINDS]
+        self.objects = [(name, kind) for name, kind in fields
+                        if kind in BINARY_KINDS]
+
+        fmt = "<B"
+        fmt += "".join(FIXED_KINDS[kind] for _, kind in fields
+                       if kind in FIXED_KINDS)
+        fmt += "I" * (1 + len(self.objects))
+        self.struct = struct.Struct(fmt)
+        self.record = namedtuple(name, self.fixed +
+                                 [name for name, _ in self.text] +
+                                 [name for name, _ in self.objects])
+
+    def encode(self, obj: Any) -> bytes:
+        text = []
+        for name, kind in self.text:
+            value = getattr(obj, name)
+            if value is None:
+                text.append(NONE)
+            elif kind == "strlist":
+                text.append(ITEM_SEP.join(value))
+            else:
+                text.append(value)
+
+        return self.pack([getattr(obj, name) for name in self.fixed],
+                         SEP.join(text).encode("utf-8"),
+                         [getattr(obj, name) for name, _ in self.objects])
+
+    def encode_raw(self, fields: dict[str, Any]) -> bytes:
+        """
+        Same as encode(), from a dict of field values where text fields
+        are UTF-8 bytes (lists of bytes for strlist fields), e.g. as read
+        from a file, so they do not need to be decoded and encoded again.
+        """
+        text = []
+        for name, kind in self.text:
+            value = fields[name]
+            if value is None:
+                text.append(NONE_BYTES)
+            elif kind == "strlist":
+                text.append(ITEM_SEP_BYTES.join(value))
+            else:
+                text.append(value)
+
+        return self.pack([fields[name] for name in self.fixed],
+                         SEP_BYTES.join(text),
+                         [fields[name] for name, _ in self.objects])
+
+    def pack(self, fixed: list, text: bytes, objects: list) -> bytes:
+        objects = [BINARY_KINDS[kind][0](value)
+                   for (_, kind), value in zip(self.objects, objects)]
+        return b"".join([
+            self.struct.pack(self.schema_id, *fixed, len(text),
+                             *map(len, objects)),
+            text,
+            *objects
+        ])
+
+    def decode(self, data: bytes):
+        values = self.struct.unpack_from(data)
+        n = len(self.fixed) + 1
+        i = self.struct.size
+        j = i + values[n]
+
+        text = []
+        for (_, kind), value in zip(self.text,
+                                    data[i:j].decode("utf-8").split(SEP)):
+            if value == NONE:
+                value = None
+            elif kind == "istr":
+                value = sys.intern(value)
+            elif kind == "strlist":
+                if value:
+                    value = [sys.intern(v) for v in value.split(ITEM_SEP)]
+                else:
+                    value = []
+
+            text.append(value)
+
+        objects = []
+        for (_, kind), size in zip(self.objects, values[n + 1:]):
+            i = j
+            j += size
+            objects.append(BINARY_KINDS[kind][1](data[i:j]))
+
+        return self.record._make([*values[1:n], *text, *objects])
+
+
+# Fields used by database.build
+PROTEIN_MIN_FIELDS = [
+    ("crc64", "str"),
+    ("reviewed", "bool"),
+    ("complete", "bool"),
+    ("taxon_id", "int"),
+    ("lineage", "strlist"),
+    ("species", "istr"),
+    ("length", "int"),
+]
+PROTEIN_FIELDS = [
+    ("identifier", "str"),
+    ("accession", "str"),
+    *PROTEIN_MIN_FIELDS,
+    ("ref_proteome", "bool"),
+]
+MATCHES_MIN_FIELDS = [
+    ("crc64", "str"),
+    ("hits", "obj"),
+]
+MATCHES_FIELDS = [
+    ("identifier", "str"),
+    ("accession", "str"),
+    ("length", "int"),
+    *MATCHES_MIN_FIELDS,
+]
+# Pfam hits refer to the families stored in the metadata of the store
+PFAM_MIN_FIELDS = [
+    ("crc64", "str"),
+    ("hits", "hits"),
+]
+PFAM_FIELDS = [
+    ("identifier", "str"),
+    ("accession", "str"),
+    ("length", "int"),
+    *PFAM_MIN_FIELDS,
+]
+
+UNIPROT = RecordCodec(1, "ProteinRecord", PROTEIN_FIELDS)
+UNIPROT_MIN = RecordCodec(2, "MinProteinRecord", PROTEIN_MIN_FIELDS)
+MATCHES = RecordCodec(3, "MatchesRecord", MATCHES_FIELDS)
+MATCHES_MIN = RecordCodec(4, "MinMatchesRecord", MATCHES_MIN_FIELDS)
+PFAM = RecordCodec(5, "PfamRecord", PFAM_FIELDS)
+PFAM_MIN = RecordCodec(6, "MinPfamRecord", PFAM_MIN_FIELDS)
+CODECS = {codec.schema_id: codec
+          for codec in [UNIPROT, UNIPROT_MIN, MATCHES, MATCHES_MIN,
+                        PFAM, PFAM_MIN]}
+
+
+def decode(data: bytes):
+    return CODECS[data[0]].decode(data)
@@ -1,143 +1,1054 @@
 import bisect
+import hashlib
 import heapq
+import json
+import lzma
+import math
+import mmap
+import multiprocessing as mp
 import os
 import pickle
+import queue
 import struct
-from dataclasses import dataclass, field
+import threading
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass, field
+from itertools import islice
 from tempfile import mkstemp
 from typing import Any, Iterable
 
 from . import io
 
 
+# File layout:
+#   header: magic, offset of index, codec name (null-padded)
+#   blocks: pickled dicts of sorted keys, compressed with the codec
+#   index:  number of blocks, key width,
+#           first key of each block (null-padded to key width),
+#           offset of each block (uint64)
+#   bloom:  number of bits (0 if no filter), number of hashes, bits
+#   metadata (optional): size, pickled dict
+MAGIC = b"PFAFSTOR"
+HEADER = struct.Struct("<8sQ8s")
+INDEX = struct.Struct("<QQ")
+OFFSET = struct.Struct("<Q")
+BLOOM = struct.Struct("<QQ")
+METADATA = struct.Struct("<Q")
+# Key sets: magic, then a Bloom filter (as in stores)
+KEYSET_MAGIC = b"PFAFKEYS"
+
+# Sorted runs are written in compressed frames of up to N items,
+# each preceded by its size
+RUN_FRAME_ITEMS = 1000
+RUN_FRAME = struct.Struct("<I")
+RUN_BUFSIZE = 1024 * 1024
+# Maximum number of runs merged at once (each has an open file and buffer):
+# more runs are first merged into intermediate runs
+MERGE_FANIN = 64
+# Estimated memory used by a buffered item, in addition to its pickled value
+ITEM_OVERHEAD = 150
+
+# Codec name -> (compress, decompress)
+CODECS = {
+    "none": (bytes, bytes),
+    "zlib": (zlib.compress, zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+try:
+    import zstandard
+except ImportError:
+    pass
+else:
+    # zstandard (de)compressors must not be used by several threads
+    # at once (e.g. prefetching threads): each thread gets its own
+    zstd_contexts = threading.local()
+
+    def zstd_compress(data: bytes) -> bytes:
+        try:
+            compressor = zstd_contexts.compressor
+        except AttributeError:
+            compressor = zstd_contexts.compressor = zstandard.ZstdCompressor()
+
+        return compressor.compress(data)
+
+    def zstd_decompress(data: bytes) -> bytes:
+        try:
+            decompressor = zstd_contexts.decompressor
+        except AttributeError:
+            decompressor = zstd_contexts.decompressor = \
+                zstandard.ZstdDecompressor()
+
+        return decompressor.decompress(data)
+
+    CODECS["zstd"] = (zstd_compress, zstd_decompress)
+
+
+class KeyIndex:
+    """Sorted, fixed-width keys read directly from a memory-mapped file."""
+
+    def __init__(self, mm: mmap.mmap, start: int, count: int, width: int):
+        self.mm = mm
+        self.start = start
+        self.count = count
+        self.width = width
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> bytes:
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+
+        start = self.start + i * self.width
+        return self.mm[start:start + self.width]
+
+    def encode(self, key: str) -> bytes:
+        # Truncating longer keys preserves the result of bisect_right
+        return key.encode("utf-8")[:self.width].ljust(self.width, b"\0")
+
+    def bisect(self, key: str) -> int:
+        return bisect.bisect_right(self, self.encode(key)) - 1
+
+
+class OffsetIndex:
+    """Block offsets read directly from a memory-mapped file."""
+
+    def __init__(self, mm: mmap.mmap, start: int, count: int):
+        self.mm = mm
+        self.start = start
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> int:
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+
+        offset, = OFFSET.unpack_from(self.mm, self.start + i * OFFSET.size)
+        return offset
+
+
+class BloomFilter:
+    """Bloom filter of store keys, using double hashing."""
+
+    def __init__(self, bits: bytearray | mmap.mmap, nbits: int,
+                 nhashes: int, start: int = 0):
+        self.bits = bits
+        self.nbits = nbits
+        self.nhashes = nhashes
+        self.start = start
+
+    @classmethod
+    def create(cls, n: int, fpr: float):
+        nbits = max(8, math.ceil(-n * math.log(fpr) / math.log(2) ** 2))
+        nhashes = max(1, round(nbits / max(n, 1) * math.log(2)))
+        return cls(bytearray((nbits + 7) // 8), nbits, nhashes)
+
+    @staticmethod
+    def hash(key: str) -> tuple[int, int]:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        return (int.from_bytes(digest[:8], "little"),
+                int.from_bytes(digest[8:], "little"))
+
+    def add(self, h1: int, h2: int):
+        for i in range(self.nhashes):
+            bit = (h1 + i * h2) % self.nbits
+            self.bits[self.start + bit // 8] |= 1 << (bit % 8)
+
+    def __contains__(self, key: str) -> bool:
+        h1, h2 = self.hash(key)
+        for i in range(self.nhashes):
+            bit = (h1 + i * h2) % self.nbits
+            if not self.bits[self.start + bit // 8] & (1 << (bit % 8)):
+                return False
+
+        return True
+
+
+@dataclass
+class BlockCache:
+    """LRU cache of decoded blocks, bounded by entries and/or bytes.
+
+    The most recently used block is always kept, even if it exceeds
+    the limits on its own.
+    """
+    maxentries: int = 100000
+    maxbytes: int = 0  # 0: not bounded by size
+    blocks: OrderedDict = field(default_factory=OrderedDict, init=False)
+    entries: int = field(default=0, init=False)
+    bytes: int = field(default=0, init=False)
+    hits: int = field(default=0, init=False)
+    misses: int = field(default=0, init=False)
+    evictions: int = field(default=0, init=False)
+
+    def get(self, i: int) -> dict[str, Any] | None:
+        try:
+            block, _ = self.blocks[i]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.blocks.move_to_end(i)
+        self.hits += 1
+        return block
+
+    def put(self, i: int, block: dict[str, Any], size: int):
+        self.blocks[i] = (block, size)
+        self.entries += len(block)
+        self.bytes += size
+
+        while len(self.blocks) > 1 and self.is_full():
+            _, (block, size) = self.blocks.popitem(last=False)
+            self.entries -= len(block)
+            self.bytes -= size
+            self.evictions += 1
+
+    def is_full(self) -> bool:
+        return (self.entries > self.maxentries or
+                0 < self.maxbytes < self.bytes)
+
+    def clear(self):
+        self.blocks.clear()
+        self.entries = self.bytes = 0
+
+    @property
+    def stats(self) -> dict[str, int | float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0,
+        }
+
+
+@dataclass
+class Run:
+    """Temporary file of sorted (key, value) items."""
+    path: str
+    # First key and offset of each frame
+    keys: list[str] = field(default_factory=list)
+    offsets: list[int] = field(default_factory=list)
+
+    @classmethod
+    def write(cls, path: str, items: Iterable[tuple[str, bytes]]):
+        """Write sorted items of pickled values."""
+        run = cls(path)
+        items = iter(items)
+        with open(path, "wb") as fh:
+            while frame := list(islice(items, RUN_FRAME_ITEMS)):
+                run.keys.append(frame[0][0])
+                run.offsets.append(fh.tell())
+                data = zlib.compress(pickle.dumps(frame), 1)
+                fh.write(RUN_FRAME.pack(len(data)))
+                fh.write(data)
+
+        return run
+
+    def iter(self, lo: str | None = None, hi: str | None = None,
+             raw: bool = False):
+        """Yield items with lo <= key < hi (values still pickled if raw)."""
+        start = 0
+        if lo is not None:
+            i = bisect.bisect_left(self.keys, lo) - 1
+            if i >= 0:
+                start = self.offsets[i]
+
+        with open(self.path, "rb", buffering=RUN_BUFSIZE) as fh:
+            fh.seek(start)
+            while header := fh.read(RUN_FRAME.size):
+                size, = RUN_FRAME.unpack(header)
+                frame = pickle.loads(zlib.decompress(fh.read(size)))
+                for key, value in frame:
+                    if lo is not None and key < lo:
+                        continue
+                    elif hi is not None and key >= hi:
+                        return
+
+                    yield key, value if raw else pickle.loads(value)
+
+
+@dataclass
+class Checkpoint:
+    """
+    Log of sorted runs written so far, and of the input batches
+    they contain (one JSON object per line), so an interrupted job
+    can resume without processing these batches again.
+    Batches are IDs, or a dict of ID -> details of the batch.
+    If `params` is set, the first line records the parameters of the job.
+    """
+    path: str
+    params: dict[str, Any] | None = None
+    runs: list[Run] = field(default_factory=list)
+    batches: set[str] = field(default_factory=set)
+
+    def iter_entries(self):
+        with open(self.path, "rt") as fh:
+            if self.params is not None:
+                fh.readline()
+
+            for line in fh:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Last line partially written when interrupted
+                    break
+
+    def load_params(self) -> dict[str, Any] | None:
+        with open(self.path, "rt") as fh:
+            try:
+                return json.loads(fh.readline())
+            except json.JSONDecodeError:
+                return None
+
+    def load(self):
+        for entry in self.iter_entries():
+            run = entry["run"]
+            if run is not None:
+                self.runs.append(Run(**run))
+
+            self.batches.update(entry["batches"])
+
+    def start(self, resume: bool = False) -> bool:
+        """
+        Resume from the checkpoint of an interrupted job if `resume` is True
+        and one exists, or start a new one. Return True if resumed.
+        """
+        if resume and os.path.isfile(self.path):
+            if (self.params is not None and
+                    self.load_params() != self.params):
+                raise ValueError(f"{self.path}: cannot resume a job "
+                                 f"with different parameters")
+
+            self.load()
+            return True
+
+        self.reset()
+        return False
+
+    def reset(self):
+        # Discard runs of a previous, incomplete execution
+        if os.path.isfile(self.path):
+            self.load()
+            for run in self.runs:
+                try:
+                    os.unlink(run.path)
+                except FileNotFoundError:
+                    pass
+
+            self.runs.clear()
+            self.batches.clear()
+
+        with open(self.path, "wt") as fh:
+            if self.params is not None:
+                fh.write(json.dumps(self.params) + "\n")
+
+    def add(self, run: Run | None, batches: list[str] | dict[str, Any]):
+        if run is not None:
+            self.runs.append(run)
+
+        self.batches.update(batches)
+        with open(self.path, "at") as fh:
+            fh.write(json.dumps({
+                "run": asdict(run) if run is not None else None,
+                "batches": batches
+            }) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    def iter_batches(self):
+        """Yield (batch ID, details) of recorded batches."""
+        for entry in self.iter_entries():
+            batches = entry["batches"]
+            if isinstance(batches, dict):
+                yield from batches.items()
+            else:
+                for batch_id in batches:
+                    yield batch_id, None
+
+
 @dataclass
 class SimpleStore:
     path: str
     mode: str = "r"
-    keys: list[str] = field(default_factory=list, init=False)
-    offsets: list[int] = field(default_factory=list, init=False)
-    buffer: dict[str, Any] = field(default_factory=dict, init=False)
+    # Set from the header in read mode
+    codec: str = "none"
+    keys: list[str] | KeyIndex = field(default_factory=list, init=False)
+    offsets: list[int] | OffsetIndex = field(default_factory=list,
+                                             init=False)
+    # Small objects shared by all items (e.g. dictionaries of names)
+    metadata: dict[str, Any] = field(default_factory=dict, init=False)
     # Read mode only
-    offset_index: int = field(default=-1, init=False)
+    cacheentries: int = 100000
+    cachebytes: int = 0
+    cache: BlockCache = field(init=False, repr=False)
+    bloom: BloomFilter | None = field(default=None, init=False, repr=False)
+    end: int = field(default=0, init=False)
+    fh: Any = field(default=None, init=False, repr=False)
+    mm: mmap.mmap | None = field(default=None, init=False, repr=False)
     # Write mode only
+    buffer: dict[str, Any] = field(default_factory=dict, init=False)
     tempbuffersize: int = 1000000
-    tempbuffer: list[Any] = field(default_factory=list, init=False)
-    files: list[str] = field(default_factory=list, init=False)
+    # Estimated memory budget of buffered items (0: not bounded)
+    tempbufferbytes: int = 0
+    # If False, the caller decides when to dump (e.g. at checkpoints)
+    autodump: bool = True
+    tempbuffer: list[tuple[str, bytes]] = field(default_factory=list,
+                                                init=False)
+    tempbytes: int = field(default=0, init=False)
+    runs: list[Run] = field(default_factory=list, init=False)
+    # Runs merged into intermediate runs, removed once the store is built
+    merged: list[Run] = field(default_factory=list, init=False)
 
     def __post_init__(self):
         self.path = os.path.abspath(self.path)
         os.makedirs(os.path.dirname(self.path), exist_ok=True)
 
+        if self.codec not in CODECS:
+            raise ValueError(f"unsupported codec: {self.codec}")
+
+        self.cache = BlockCache(self.cacheentries, self.cachebytes)
+
         if self.mode == "r":
             # Load index
             self.load()
 
     def add(self, key: str, value: Any):
+        # Values are pickled right away: their size is known exactly
+        value = pickle.dumps(value)
         self.tempbuffer.append((key, value))
-        if len(self.tempbuffer) == self.tempbuffersize:
+        self.tempbytes += len(key) + len(value) + ITEM_OVERHEAD
+        if self.autodump and self.is_full():
             self.dump()
 
+    def is_full(self) -> bool:
+        return (len(self.tempbuffer) >= self.tempbuffersize or
+                0 < self.tempbufferbytes <= self.tempbytes)
+
     def dump(self):
         if self.tempbuffer:
             fd, path = mkstemp(prefix=os.path.basename(self.path),
                                dir=os.path.dirname(self.path))
-            with open(fd, "wb") as fh:
-                for item in sorted(self.tempbuffer, key=lambda x: x[0]):
-                    pickle.dump(item, fh)
-
-            self.files.append(path)
+            os.close(fd)
+            self.tempbuffer.sort(key=lambda x: x[0])
+            self.runs.append(Run.write(path, self.tempbuffer))
             self.tempbuffer.clear()
+            self.tempbytes = 0
 
-    @staticmethod
-    def iter_dump(file: str):
-        with open(file, "rb") as fh:
-            while True:
-                try:
-                    yield pickle.load(fh)
-                except EOFError:
-                    break
+    def reduce_runs(self, processes: int = 1):
+        """
+        Merge runs into intermediate runs, at most MERGE_FANIN at a time,
+        until at most MERGE_FANIN runs are left.
+        Runs added by the caller are kept (e.g. a checkpoint refers to them)
+        until remove_runs() is called.
+        """
+        created = set()
+        while len(self.runs) > MERGE_FANIN:
+            # Groups of similar size, keeping runs in order
+            n = math.ceil(len(self.runs) / MERGE_FANIN)
+            size = math.ceil(len(self.runs) / n)
+            args = [(self.path, self.runs[i:i + size])
+                    for i in range(0, len(self.runs), size)]
+
+            if processes > 1:
+                with mp.Pool(min(processes, len(args))) as pool:
+                    runs = pool.map(merge_runs, args)
+            else:
+                runs = [merge_runs(arg) for arg in args]
+
+            for run in self.runs:
+                if run.path in created:
+                    os.unlink(run.path)
+                else:
+                    self.merged.append(run)
+
+            self.runs[:] = runs
+            created = {run.path for run in runs}
+
+    def remove_runs(self):
+        for run in self.runs + self.merged:
+            os.unlink(run.path)
+
+        self.runs.clear()
+        self.merged.clear()
 
     def build(self, iterable: Iterable | None = None,
               buffersize: int = 100000,
-              verbose: bool = False):
+              fpr: float = 0,
+              processes: int = 1,
+              verbose: bool = False) -> int:
+        """
+        Merge sorted (key, value) items into the store.
+        If `fpr` is set, a Bloom filter with this false-positive rate
+        is written as well, so lookups of missing keys
+        can be rejected without reading blocks.
+        If no `iterable` is passed, runs are merged, and if `processes` > 1,
+        blocks are encoded in parallel.
+        """
         self.dump()
+        if iterable is None:
+            self.reduce_runs(processes)
+
         self.buffer.clear()
         self.keys.clear()
         self.offsets.clear()
+
+        if fpr > 0:
+            # Keep key hashes on disk until we know how many keys we have
+            fd, hashfile = mkstemp(prefix=os.path.basename(self.path),
+                                   dir=os.path.dirname(self.path))
+            hfh = open(fd, "wb")
+        else:
+            hashfile = hfh = None
+
         with open(self.path, "wb") as fh:
-            fh.write(struct.pack("<Q", 0))
+            fh.write(HEADER.pack(MAGIC, 0, self.codec.encode()))
+
+            if iterable is None and processes > 1:
+                items = heapq.merge(*[run.iter(raw=True) for run in self.runs],
+                                    key=lambda x: x[0])
+                progress = self.write_blocks_parallel(fh, items, buffersize,
+                                                      hfh, processes, verbose)
+            else:
+                if iterable is None:
+                    iterable = [run.iter() for run in self.runs]
+
+                items = heapq.merge(*iterable, key=lambda x: x[0])
+                progress = self.write_blocks(fh, items, buffersize, hfh,
+                                             verbose)
+
+            offset = fh.tell()
+            keys = [key.encode("utf-8") for key in self.keys]
+            width = max(map(len, keys), default=0)
+            fh.write(INDEX.pack(len(keys), width))
+            fh.write(b"".join(key.ljust(width, b"\0") for key in keys))
+            fh.write(b"".join(OFFSET.pack(o) for o in self.offsets))
+
+            if hfh is not None:
+                hfh.close()
+                bloom = self.build_bloom(hashfile, progress, fpr)
+                os.unlink(hashfile)
+                fh.write(BLOOM.pack(bloom.nbits, bloom.nhashes))
+                fh.write(bloom.bits)
+            else:
+                fh.write(BLOOM.pack(0, 0))
+
+            if self.metadata:
+                data = pickle.dumps(self.metadata)
+                fh.write(METADATA.pack(len(data)))
+                fh.write(data)
+
+            fh.seek(0)
+            fh.write(HEADER.pack(MAGIC, offset, self.codec.encode()))
+
+            if verbose:
+                io.log(f"\t{progress:,}")
+
+        self.remove_runs()
+        return progress
+
+    def write_blocks(self, fh, items: Iterable, buffersize: int,
+                     hfh=None, verbose: bool = False) -> int:
+        progress = 0
+        step = milestone = 1e7
+        for key, value in items:
+            self.buffer[key] = value
+
+            if len(self.buffer) == buffersize:
+                progress += self.write_block(fh, hfh)
 
-            if iterable is None:
-                iterable = [self.iter_dump(path) for path in self.files]
+                if verbose and progress >= milestone:
+                    io.log(f"\t{progress:,}")
+                    milestone += step
 
-            progress = 0
-            step = milestone = 1e7
-            for key, value in heapq.merge(*iterable, key=lambda x: x[0]):
-                self.buffer[key] = value
+        if self.buffer:
+            progress += self.write_block(fh, hfh)
 
-                if len(self.buffer) == buffersize:
-                    self.keys.append(min(self.buffer))
+        return progress
+
+    def write_block(self, fh, hfh=None) -> int:
+        # Keys are added in sorted order: the first one is the smallest
+        self.keys.append(next(iter(self.buffer)))
+        self.offsets.append(fh.tell())
+        compress, _ = CODECS[self.codec]
+        fh.write(compress(pickle.dumps(self.buffer)))
+
+        if hfh is not None:
+            hash_keys(self.buffer).tofile(hfh)
+
+        n = len(self.buffer)
+        self.buffer.clear()
+        return n
+
+    def write_blocks_parallel(self, fh, items: Iterable, buffersize: int,
+                              hfh=None, processes: int = 2,
+                              verbose: bool = False) -> int:
+        """
+        Same as write_blocks(), for items of pickled values:
+        blocks are encoded by a pool of workers, and written in order.
+        """
+        progress = 0
+        step = milestone = 1e7
+        pending = deque()
+        with mp.Pool(processes) as pool:
+            items = iter(items)
+            while True:
+                block = list(islice(items, buffersize))
+                if block:
+                    pending.append(pool.apply_async(
+                        encode_block, (self.codec, block, hfh is not None)
+                    ))
+
+                # Bound the number of blocks held in memory
+                while pending and (not block or
+                                   len(pending) >= 2 * processes):
+                    first_key, n, data, hashes = pending.popleft().get()
+                    self.keys.append(first_key)
                     self.offsets.append(fh.tell())
-                    pickle.dump(self.buffer, fh)
-                    progress += len(self.buffer)
-                    self.buffer.clear()
+                    fh.write(data)
+                    if hashes is not None:
+                        hashes.tofile(hfh)
 
+                    progress += n
                     if verbose and progress >= milestone:
                         io.log(f"\t{progress:,}")
                         milestone += step
 
-            if self.buffer:
-                self.keys.append(min(self.buffer))
-                self.offsets.append(fh.tell())
-                pickle.dump(self.buffer, fh)
-                progress += len(self.buffer)
-                self.buffer.clear()
+                if not block:
+                    break
 
-            offset = fh.tell()
-            pickle.dump(self.keys, fh)
-            pickle.dump(self.offsets, fh)
+        return progress
 
-            fh.seek(0)
-            fh.write(struct.pack("<Q", offset))
+    @staticmethod
+    def build_bloom(hashfile: str, n: int, fpr: float) -> BloomFilter:
+        bloom = BloomFilter.create(n, fpr)
+        with open(hashfile, "rb") as fh:
+            while True:
+                hashes = array("Q")
+                try:
+                    hashes.fromfile(fh, 2 * 1000000)
+                except EOFError:
+                    pass
 
-            if verbose:
-                io.log(f"\t{progress:,}")
+                if not hashes:
+                    break
 
-        for path in self.files:
-            os.unlink(path)
+                for i in range(0, len(hashes), 2):
+                    bloom.add(hashes[i], hashes[i + 1])
 
-    def load(self, offset: int = 0):
-        with open(self.path, "rb") as fh:
-            if offset > 0:
-                fh.seek(offset)
-                self.buffer = pickle.load(fh)
-            else:
-                offset, = struct.unpack("<Q", fh.read(8))
-                fh.seek(offset)
-                self.keys = pickle.load(fh)
-                self.offsets = pickle.load(fh)
+        return bloom
+
+    def load(self):
+        self.fh = open(self.path, "rb")
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.end, codec = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{self.path}: unsupported store format")
+
+        self.codec = codec.rstrip(b"\0").decode()
+        if self.codec not in CODECS:
+            self.close()
+            raise ValueError(f"{self.path}: unsupported codec {self.codec}")
+
+        count, width = INDEX.unpack_from(self.mm, self.end)
+        start = self.end + INDEX.size
+        self.keys = KeyIndex(self.mm, start, count, width)
+        self.offsets = OffsetIndex(self.mm, start + count * width, count)
+
+        start += count * (width + OFFSET.size)
+        nbits, nhashes = BLOOM.unpack_from(self.mm, start)
+        if nbits > 0:
+            self.bloom = BloomFilter(self.mm, nbits, nhashes,
+                                     start + BLOOM.size)
+
+        start += BLOOM.size + (nbits + 7) // 8
+        if start < len(self.mm):
+            size, = METADATA.unpack_from(self.mm, start)
+            start += METADATA.size
+            self.metadata = pickle.loads(self.mm[start:start + size])
+
+    def read_block(self, i: int) -> tuple[dict[str, Any], int]:
+        start = self.offsets[i]
+        end = self.offsets[i + 1] if i + 1 < len(self.offsets) else self.end
+        _, decompress = CODECS[self.codec]
+        data = decompress(self.mm[start:end])
+        return pickle.loads(data), len(data)
+
+    def get_block(self, i: int) -> dict[str, Any]:
+        block = self.cache.get(i)
+        if block is None:
+            block, size = self.read_block(i)
+            self.cache.put(i, block, size)
+
+        return block
+
+    def close(self):
+        self.cache.clear()
+        self.bloom = None
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
 
     def __getitem__(self, item):
-        if item in self.buffer:
-            return self.buffer[item]
+        if self.bloom is not None and item not in self.bloom:
+            raise KeyError(item)
 
-        i = bisect.bisect_right(self.keys, item) - 1
-        if i < 0 or i == self.offset_index:
+        i = self.keys.bisect(item)
+        if i < 0:
             raise KeyError(item)
 
-        self.offset_index = i
+        return self.get_block(i)[item]
 
+    def get(self, item, default=None):
         try:
-            offset = self.offsets[i]
-        except IndexError:
-            raise KeyError(item)
+            return self[item]
+        except KeyError:
+            return default
+
+    def iter_blocks(self):
+        for i in range(len(self.offsets)):
+            block, _ = self.read_block(i)
+            yield block
+
+    def items(self, prefetch: int = 0):
+        """
+        Sequential scan: blocks are not cached.
+        If `prefetch` > 0, up to `prefetch` blocks are read and decoded
+        ahead in a background thread.
+        """
+        blocks = self.iter_blocks()
+        if prefetch > 0:
+            blocks = prefetched(blocks, prefetch)
+
+        for block in blocks:
+            # Blocks are written in key order
+            yield from block.items()
+
+
+@dataclass
+class ShardedStore:
+    """
+    Store split into range-partitioned SimpleStore shards.
+    The manifest (at `path`) is a JSON file mapping the lower bound
+    of each key range to a shard file.
+    """
+    path: str
+    mode: str = "r"
+    codec: str = "none"
+    shards: int = 1
+    # Lower bound (inclusive) of each shard's key range, None for the first
+    bounds: list[str | None] = field(default_factory=list, init=False)
+    files: list[str] = field(default_factory=list, init=False)
+    # Read mode only
+    cacheentries: int = 100000
+    cachebytes: int = 0
+    stores: dict[int, SimpleStore] = field(default_factory=dict,
+                                           init=False, repr=False)
+    # Write mode only
+    tempbuffersize: int = 1000000
+    tempbufferbytes: int = 0
+    writer: SimpleStore | None = field(default=None, init=False,
+                                       repr=False)
+
+    def __post_init__(self):
+        self.path = os.path.abspath(self.path)
+
+        if self.mode == "r":
+            self.load()
+        else:
+            self.writer = SimpleStore(self.path, mode="w", codec=self.codec,
+                                      tempbuffersize=self.tempbuffersize,
+                                      tempbufferbytes=self.tempbufferbytes)
+
+    @property
+    def runs(self) -> list[Run]:
+        return self.writer.runs
+
+    @property
+    def metadata(self) -> dict[str, Any]:
+        # Written to every shard, so each can be used on its own
+        if self.writer is not None:
+            return self.writer.metadata
+        elif self.files:
+            return self.shard(0).metadata
+        else:
+            return {}
+
+    def add(self, key: str, value: Any):
+        self.writer.add(key, value)
+
+    def dump(self):
+        self.writer.dump()
 
-        self.load(offset)
-        return self.buffer[item]
+    def build(self, buffersize: int = 100000, fpr: float = 0,
+              processes: int = 1, verbose: bool = False) -> int:
+        self.dump()
+        self.writer.reduce_runs(processes)
+        bounds = sample_bounds(self.runs, self.shards)
+        self.bounds = [None] + bounds
+        self.files = [f"{self.path}.{i}" for i in range(len(self.bounds))]
+
+        args = []
+        for path, lo, hi in zip(self.files, self.bounds, bounds + [None]):
+            args.append((path, self.codec, self.runs, lo, hi, buffersize,
+                         fpr, self.metadata))
+
+        progress = 0
+        with mp.Pool(max(1, min(processes, len(args)))) as pool:
+            for n in pool.imap(build_shard, args):
+                progress += n
+                if verbose:
+                    io.log(f"\t{progress:,}")
+
+        with open(self.path, "wt") as fh:
+            json.dump({
+                "codec": self.codec,
+                "shards": [
+                    {"path": os.path.basename(path), "lo": lo}
+                    for path, lo in zip(self.files, self.bounds)
+                ]
+            }, fh, indent=2)
+
+        self.writer.remove_runs()
+        return progress
+
+    def load(self):
+        with open(self.path, "rt") as fh:
+            manifest = json.load(fh)
+
+        self.codec = manifest["codec"]
+        self.shards = len(manifest["shards"])
+        dirname = os.path.dirname(self.path)
+        for shard in manifest["shards"]:
+            self.files.append(os.path.join(dirname, shard["path"]))
+            self.bounds.append(shard["lo"])
+
+    def shard(self, i: int) -> SimpleStore:
+        try:
+            return self.stores[i]
+        except KeyError:
+            sstore = self.stores[i] = SimpleStore(
+                self.files[i],
+                cacheentries=self.cacheentries,
+                cachebytes=self.cachebytes
+            )
+            return sstore
+
+    def close(self):
+        for sstore in self.stores.values():
+            sstore.close()
+
+        self.stores.clear()
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __getitem__(self, item):
+        i = bisect.bisect_right(self.bounds, item, lo=1)
+        return self.shard(i - 1)[item]
+
+    def get(self, item, default=None):
+        try:
+            return self[item]
+        except KeyError:
+            return default
+
+    def items(self, prefetch: int = 0):
+        # Shards are sorted: each can also be scanned on its own
+        for i in range(len(self.files)):
+            yield from self.shard(i).items(prefetch)
+
+
+def open_store(path: str, **kwargs) -> SimpleStore | ShardedStore:
+    with open(path, "rb") as fh:
+        magic = fh.read(len(MAGIC))
+        if magic == MAGIC:
+            return SimpleStore(path, **kwargs)
+
+        # Otherwise, expect the JSON manifest of a sharded store
+        # (checking the first byte avoids reading stores of older formats)
+        manifest = None
+        if magic.lstrip()[:1] == b"{":
+            fh.seek(0)
+            try:
+                manifest = json.load(fh)
+            except ValueError:
+                # Includes UnicodeDecodeError
+                pass
+
+    if not isinstance(manifest, dict) or "shards" not in manifest:
+        raise ValueError(f"{path}: unsupported store format")
+
+    return ShardedStore(path, **kwargs)
+
+
+def write_keyset(path: str, keys: Iterable[str], fpr: float) -> int:
+    """
+    Write a Bloom filter of keys, so other steps can test membership
+    without loading the keys. Return the number of keys.
+    """
+    path = os.path.abspath(path)
+    fd, hashfile = mkstemp(prefix=os.path.basename(path),
+                           dir=os.path.dirname(path))
+    n = 0
+    with open(fd, "wb") as hfh:
+        keys = iter(keys)
+        while chunk := list(islice(keys, 1000000)):
+            hash_keys(chunk).tofile(hfh)
+            n += len(chunk)
+
+    bloom = SimpleStore.build_bloom(hashfile, n, fpr)
+    os.unlink(hashfile)
+
+    with open(path, "wb") as fh:
+        fh.write(KEYSET_MAGIC)
+        fh.write(BLOOM.pack(bloom.nbits, bloom.nhashes))
+        fh.write(bloom.bits)
+
+    return n
+
+
+def load_keyset(path: str) -> BloomFilter:
+    with open(path, "rb") as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if mm[:len(KEYSET_MAGIC)] != KEYSET_MAGIC:
+        mm.close()
+        raise ValueError(f"{path}: unsupported key set format")
+
+    nbits, nhashes = BLOOM.unpack_from(mm, len(KEYSET_MAGIC))
+    return BloomFilter(mm, nbits, nhashes, len(KEYSET_MAGIC) + BLOOM.size)
+
+
+def sample_bounds(runs: list[Run], n: int) -> list[str]:
+    """Choose up to n-1 keys splitting runs into ranges of similar size."""
+    samples = sorted(key for run in runs for key in run.keys)
+    bounds = []
+    for i in range(1, n):
+        if samples:
+            key = samples[i * len(samples) // n]
+            if not bounds or key > bounds[-1]:
+                bounds.append(key)
+
+    return bounds
+
+
+def build_shard(args: tuple) -> int:
+    """Build a complete store from the items of runs within a key range."""
+    path, codec, runs, lo, hi, buffersize, fpr, metadata = args
+    sstore = SimpleStore(path, mode="w", codec=codec)
+    sstore.metadata = metadata
+    return sstore.build(iterable=[run.iter(lo, hi) for run in runs],
+                        buffersize=buffersize,
+                        fpr=fpr)
+
+
+def merge_runs(args: tuple) -> Run:
+    """Merge runs into a new run."""
+    path, runs = args
+    fd, runpath = mkstemp(prefix=os.path.basename(path),
+                          dir=os.path.dirname(path))
+    os.close(fd)
+    items = heapq.merge(*[run.iter(raw=True) for run in runs],
+                        key=lambda x: x[0])
+    return Run.write(runpath, items)
+
+
+def encode_block(codec: str, items: list[tuple[str, bytes]],
+                 bloom: bool) -> tuple[str, int, bytes, array | None]:
+    """
+    Encode a block of sorted items of pickled values.
+    Return its first key, number of items, data, and key hashes if `bloom`.
+    """
+    block = {key: pickle.loads(value) for key, value in items}
+    compress, _ = CODECS[codec]
+    data = compress(pickle.dumps(block))
+    hashes = hash_keys(block) if bloom else None
+    return items[0][0], len(block), data, hashes
+
+
+def hash_keys(keys: Iterable[str]) -> array:
+    """Hashes of keys for Bloom filters, two per key."""
+    hashes = array("Q")
+    for key in keys:
+        hashes.extend(BloomFilter.hash(key))
+
+    return hashes
+
+
+def prefetched(iterable: Iterable, depth: int):
+    """Consume `iterable` in a background thread, up to `depth` items ahead."""
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    end = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+
+                items.put((item, None))
+        except Exception as exc:
+            items.put((end, exc))
+        else:
+            items.put((end, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, exc = items.get()
+            if exc is not None:
+                raise exc
+            elif item is end:
+                break
+
+            yield item
+    finally:
+        # Unblock the producer if the consumer stopped early
+        stop.set()
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def join(sstore: SimpleStore | ShardedStore,
+         *others: SimpleStore | ShardedStore,
+         prefetch: int = 0):
+    """
+    Left join of stores sorted by the same keys, in a single sequential scan.
+    Yields (key, value, *values) for each item in `sstore`, where `values`
+    are the values of the same key in `others` (None if missing).
+    """
+    cursors = [iter(other.items(prefetch)) for other in others]
+    heads = [next(cursor, None) for cursor in cursors]
+
+    for key, value in sstore.items(prefetch):
+        values = []
+        for i, cursor in enumerate(cursors):
+            head = heads[i]
+            while head is not None and head[0] < key:
+                head = next(cursor, None)
+
+            heads[i] = head
+            if head is not None and head[0] == key:
+                values.append(head[1])
+            else:
+                values.append(None)
 
-    def items(self):
-        for offset in self.offsets:
-            self.load(offset)
-            for key in sorted(self.buffer):
-                value = self.buffer[key]
-                yield key, value
+        yield key, value, *values
@@ -1,74 +1,296 @@
 import gzip
+import multiprocessing as mp
+import os
 import re
+from typing import Any, Iterable
 
-from . import io, models, store
+from . import alphafold, io, records, store
 
+# Size of batches of complete records read from flat files
+CHUNK_SIZE = 8 * 1024 ** 2
+# Manual: https://web.expasy.org/docs/userman.html
+OX_REG = re.compile(rb"NCBI_TaxID=(\d+)")
 
-def parse(file: str):
+
+def iter_chunks(file: str, size: int = CHUNK_SIZE):
+    """Yield batches of complete records, split on `//` lines."""
     if file.lower().endswith(".gz"):
         _open = gzip.open
     else:
         _open = open
 
-    # Manual: https://web.expasy.org/docs/userman.html
-    ox_reg = re.compile(r"NCBI_TaxID=(\d+)")
-
-    with _open(file, mode="rt") as fh:
-        for line in map(str.rstrip, fh):
-            key = line[:2]
-            value = line[5:]
-
-            if key == "ID":
-                cols = value.split()
-                uniprot_id = cols[0]
-                status = cols[1].rstrip(";")
-                length = int(cols[2])
-                entry = models.Protein(identifier=uniprot_id,
-                                       length=length,
-                                       reviewed=status == "Reviewed")
-            elif key == "AC" and not entry.accession:
-                entry.accession = value.split(";")[0]
-            elif key == "DE":
-                if value.startswith("Flags:") and "Fragment" in value:
-                    entry.complete = False
-            elif key == "OS":
-                if entry.species:
-                    entry.species += " " + value
-                else:
-                    entry.species = value
-            if key == "OC":
-                for node in value.rstrip(".").split(";"):
-                    entry.lineage.append(node.strip())
-            elif key == "OX":
-                entry.taxon_id = int(ox_reg.match(value).group(1))
-            elif key == "KW":
-                if not entry.ref_proteome:
-                    for e in value.rstrip(".").split(";"):
-                        if e.strip() == "Reference proteome":
-                            entry.ref_proteome = True
-                            break
-            elif key == "SQ":
-                cols = value.split()
-                entry.crc64 = cols[5]
-            elif key == "//":
-                entry.clean()
-                yield entry
-
-
-def index(sprot_file: str, trembl_file: str, output: str):
+    with _open(file, mode="rb") as fh:
+        buffer = b""
+        while data := fh.read(size):
+            buffer += data
+            i = buffer.rfind(b"\n//\n")
+            if i >= 0:
+                yield buffer[:i + 4]
+                buffer = buffer[i + 4:]
+
+    if buffer.strip():
+        yield buffer
+
+
+def parse_chunk(chunk: bytes):
+    """
+    Parse a batch of complete records, without decoding or splitting
+    lines that are not used: only the ID to OX lines, KW lines,
+    and the SQ line are read. Other lines (references, comments,
+    cross-references, features, sequence) are skipped with bytes.find(),
+    and each part of a record is searched once.
+    Yield the fields of each record as a dict, with text fields
+    left as bytes (see records.RecordCodec.encode_raw).
+    """
+    start = 0
+    # Lines from ID to OX always come first, in this order
+    while (ox := chunk.find(b"\nOX   ", start)) >= 0:
+        sq = chunk.find(b"\nSQ   ", ox)
+        if sq < 0:
+            break
+
+        eol = chunk.find(b"\n", start)
+        cols = chunk[start + 5:eol].split()
+
+        i = chunk.find(b"\nAC   ", eol, ox) + 6
+        accession = chunk[i:chunk.find(b";", i)]
+
+        # Flags is the last DE line, OS lines follow DE and GN lines
+        os_ = chunk.find(b"\nOS   ", i, ox)
+        j = chunk.rfind(b"\nDE   ", i, os_)
+        complete = (not chunk.startswith(b"Flags:", j + 6) or
+                    b"Fragment" not in chunk[j:chunk.find(b"\n", j + 1)])
+
+        # OS lines, optional OG lines, then OC lines up to the OX line
+        oc = chunk.find(b"\nOC   ", os_, ox)
+        if oc < 0:
+            oc = ox
+
+        og = chunk.find(b"\nOG   ", os_, oc)
+        species = chunk[os_ + 6:og if og >= 0 else oc]
+        species = species.replace(b"\nOS   ", b" ").rstrip(b".")
+        lineage = chunk[oc + 6:ox].replace(b"\nOC   ", b" ").rstrip(b".")
+
+        # PE, KW, and FT lines come last, in this order
+        i = max(chunk.rfind(b"\nPE   ", ox, sq), ox)
+        j = chunk.find(b"\nFT   ", i, sq)
+        # Keywords may have evidence tags, e.g. Reference proteome {...}
+        ref_proteome = chunk.find(b"Reference proteome", i,
+                                  j if j >= 0 else sq) >= 0
+
+        eol = chunk.find(b"\n", sq + 1)
+        yield {
+            "identifier": cols[0],
+            "accession": accession,
+            "crc64": chunk[sq + 6:eol].split()[5],
+            "reviewed": cols[1] == b"Reviewed;",
+            "complete": complete,
+            "taxon_id": int(OX_REG.match(chunk, ox + 6).group(1)),
+            "lineage": lineage.split(b"; ") if lineage else [],
+            "species": species,
+            "length": int(cols[2]),
+            "ref_proteome": ref_proteome,
+        }
+
+        # Skip the sequence: it takes at least one byte per residue
+        start = chunk.find(b"\n//", eol + int(cols[2])) + 4
+
+
+def index(sprot_file: str, trembl_file: str, output: str,
+          codec: str = "none", minimal: bool = False, memory: int = 0,
+          processes: int = 1, keep_keys: str | None = None,
+          resume: bool = False, fpr: float = 0):
+    """
+    Index UniProtKB entries.
+    If `keep_keys` is set, only entries in this key set
+    (see alphafold.export_keys) are indexed.
+    Sorted runs are recorded in a checkpoint with the batches of records
+    they contain: if `resume` is True, batches already processed
+    by an interrupted job are skipped.
+    """
     io.log("parsing UniProtKB entries")
 
-    sstore = store.SimpleStore(output, "w")
-    n = 0
-    for file in [sprot_file, trembl_file]:
-        for entry in parse(file):
-            sstore.add(entry.accession, entry)
-            n += 1
+    sstore = store.SimpleStore(output, "w", codec=codec,
+                               tempbufferbytes=memory)
+    files = [sprot_file, trembl_file]
+    checkpoint = store.Checkpoint(f"{sstore.path}.progress.jsonl", {
+        "files": [os.path.abspath(file) for file in files],
+        "chunk_size": CHUNK_SIZE,
+        "minimal": minimal,
+        "keep_keys": keep_keys,
+    })
+    if checkpoint.start(resume):
+        io.log(f"resuming: {len(checkpoint.batches):,} batches "
+               f"already processed")
 
-            if n % 1e7 == 0:
-                io.log(f"\t{n:,}")
+    if processes > 1:
+        n = index_parallel(files, sstore, minimal, memory, processes,
+                           keep_keys, checkpoint)
+    else:
+        # Dump at batch boundaries, so each run contains complete batches
+        writer = store.SimpleStore(output, "w", tempbufferbytes=memory,
+                                   autodump=False)
+        keep = store.load_keyset(keep_keys) if keep_keys else None
+        batches = (batch
+                   for i, file in enumerate(files)
+                   for batch in iter_pending_batches(file, i,
+                                                     checkpoint.batches))
+        n = 0
+        milestone = step = 1e7
+        for obj in add_batches(writer, batches, minimal, keep):
+            if isinstance(obj, int):
+                n += obj
+                if n >= milestone:
+                    io.log(f"\t{n:,}")
+                    milestone += step
+            else:
+                checkpoint.add(*obj)
 
     io.log(f"\t{n:,}")
     io.log("indexing")
-    sstore.build(verbose=True)
+    sstore.runs.extend(checkpoint.runs)
+    sstore.build(fpr=fpr, processes=processes, verbose=True)
+    os.unlink(checkpoint.path)
     io.log("complete")
+
+
+def iter_pending_batches(file: str, file_id: int, done: set[str]):
+    """Yield (batch ID, chunk) for chunks not already processed."""
+    for i, chunk in enumerate(iter_chunks(file)):
+        batch_id = f"{file_id}:{i}"
+        if batch_id not in done:
+            yield batch_id, chunk
+
+
+def add_batches(sstore: store.SimpleStore, batches: Iterable,
+                minimal: bool, keep: store.BloomFilter | None):
+    """
+    Add the entries of (batch ID, chunk) batches to a store
+    that is not dumped automatically. Yield the number of entries
+    added for each batch, and (sorted run, batch IDs)
+    once the entries of complete batches are dumped.
+    """
+    batch_ids = []
+    for batch_id, chunk in batches:
+        n = 0
+        for entry in parse_chunk(chunk):
+            if add_entry(sstore, entry, minimal, keep):
+                n += 1
+
+        yield n
+        batch_ids.append(batch_id)
+        if sstore.is_full():
+            sstore.dump()
+            yield sstore.runs[-1], batch_ids
+            batch_ids = []
+
+    if batch_ids:
+        if sstore.tempbuffer:
+            sstore.dump()
+            yield sstore.runs[-1], batch_ids
+        else:
+            # Batches without entries are recorded as well
+            yield None, batch_ids
+
+
+def add_entry(sstore: store.SimpleStore, entry: dict[str, Any],
+              minimal: bool, keep: store.BloomFilter | None = None) -> bool:
+    accession = entry["accession"].decode()
+    if (keep is not None and
+            alphafold.join_key(accession,
+                               entry["crc64"].decode()) not in keep):
+        return False
+
+    if minimal:
+        # Only the superkingdom is used
+        entry["lineage"] = entry["lineage"][:1]
+        record_codec = records.UNIPROT_MIN
+    else:
+        record_codec = records.UNIPROT
+
+    sstore.add(accession, record_codec.encode_raw(entry))
+    return True
+
+
+def index_parallel(files: list[str], sstore: store.SimpleStore,
+                   minimal: bool, memory: int, processes: int,
+                   keep_keys: str | None,
+                   checkpoint: store.Checkpoint) -> int:
+    """
+    Read files concurrently (one reader per file), and parse batches
+    of records in a pool of workers, each writing its own sorted runs.
+    """
+    num_workers = max(1, processes - len(files))
+    # Bound the number of batches waiting to be parsed
+    chunkqueue = mp.Queue(maxsize=2 * num_workers)
+    outqueue = mp.Queue()
+
+    readers = []
+    for i, file in enumerate(files):
+        p = mp.Process(target=reader,
+                       args=(file, i, checkpoint.batches, chunkqueue,
+                             outqueue))
+        p.start()
+        readers.append(p)
+
+    workers = []
+    for _ in range(num_workers):
+        p = mp.Process(target=worker,
+                       args=(chunkqueue, sstore.path, minimal,
+                             memory // num_workers, keep_keys, outqueue))
+        p.start()
+        workers.append(p)
+
+    n = 0
+    milestone = step = 1e7
+    running_readers = len(readers)
+    running_workers = len(workers)
+    while running_readers or running_workers:
+        obj = outqueue.get()
+        if isinstance(obj, int):
+            n += obj
+            if n >= milestone:
+                io.log(f"\t{n:,}")
+                milestone += step
+        elif isinstance(obj, str):
+            # A reader is done
+            running_readers -= 1
+            if running_readers == 0:
+                for _ in workers:
+                    chunkqueue.put(None)
+        elif obj is None:
+            running_workers -= 1
+        else:
+            # Sorted run spilled by a worker, and the batches it contains
+            checkpoint.add(*obj)
+
+    for p in readers + workers:
+        p.join()
+
+    return n
+
+
+def reader(file: str, file_id: int, done: set[str], chunkqueue: mp.Queue,
+           outqueue: mp.Queue):
+    for batch in iter_pending_batches(file, file_id, done):
+        chunkqueue.put(batch)
+
+    # Wait until batches are actually sent, so that they are read
+    # before the end-of-input markers sent once all readers are done
+    chunkqueue.close()
+    chunkqueue.join_thread()
+    outqueue.put(file)
+
+
+def worker(chunkqueue: mp.Queue, output: str, minimal: bool, memory: int,
+           keep_keys: str | None, outqueue: mp.Queue):
+    # Dump at batch boundaries, so each run contains complete batches
+    sstore = store.SimpleStore(output, "w", tempbufferbytes=memory,
+                               autodump=False)
+    # Each worker maps the key set: pages are shared by the OS
+    keep = store.load_keyset(keep_keys) if keep_keys else None
+    for obj in add_batches(sstore, iter(chunkqueue.get, None), minimal,
+                           keep):
+        outqueue.put(obj)
+
+    outqueue.put(None)
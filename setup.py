@@ -13,10 +13,12 @@ setup(
    include_package_data=True,
    zip_safe=False,
    install_requires=[
-      "crc64iso==0.0.2",
       "flask~=3.0.0",
       "gunicorn~=21.2.0"
    ],
+   extras_require={
+      "bench": ["crc64iso==0.0.2"],
+   },
    entry_points={
       "console_scripts": [
          "pfafindex=pfam_alphafold.cli:prepare",